@@ -4,10 +4,20 @@
 # http://www.indigodomo.com
 
 import indigo
+import fnmatch
+import heapq
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import time
+from array import array
+from collections import deque
 from datetime import datetime
 import re
+import select
+import selectors
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 try:
     from shlex import quote as cmd_quote
 except ImportError:
@@ -25,16 +35,22 @@ k_processStatusDict = { 'I': {'txt': 'idle',      'img': indigo.kStateImageSel.A
                         'T': {'txt': 'stopped',   'img': indigo.kStateImageSel.AvStopped        },
                         'U': {'txt': 'waiting',   'img': indigo.kStateImageSel.AvPaused         },
                         'Z': {'txt': 'zombie',    'img': indigo.kStateImageSel.SensorTripped    },
-                        'X': {'txt': 'off',       'img': indigo.kStateImageSel.SensorOff        }   }
-
-k_psGetDataCmd      = "/bin/ps -awxc -opid,state,pcpu,pmem,lstart,etime,args"
-k_psInfoGroupsKeys  =           (      'pid',    'state',             'pcpu',     'pmem',   'lstart',  'etime',   'args' )
-k_psInfoGroupsRegex = re.compile(r"^ *([0-9]+) +([IRSTUZ])[sA-Z+<>]* +([0-9.,]+) +([0-9.,]+) +(.+?)   +([0-9:-]+) +(.+)$")
-
-k_psSearch_pid      = "^ *{pid} .*$".format
-k_psSearch_appname  = "^.*[0-9] {processname}( -psn_[0-9_]*)?$".format
-k_psSearch_helper   = "^.*[0-9] {processname} ?( -.+)*$".format
-k_psSearch_daemon   = "^.*[0-9] {processname} ?{args}$".format
+                        'X': {'txt': 'off',       'img': indigo.kStateImageSel.SensorOff        },
+                        # pending launch/quit commands, not ps states
+                        'L': {'txt': 'launching', 'img': indigo.kStateImageSel.TimerOn          },
+                        'Q': {'txt': 'quitting',  'img': indigo.kStateImageSel.TimerOn          }   }
+
+k_psGetDataCmd      = "/bin/ps -awxc -opid,ppid,state,pcpu,pmem,lstart,etime,args"
+k_psGetPidsCmd      = "/bin/ps -c -p{pids} -opid,ppid,state,pcpu,pmem,lstart,etime,args".format
+k_psInfoGroupsKeys  =           (      'pid',     'ppid',    'state',             'pcpu',     'pmem',   'lstart',  'etime',   'args' )
+k_psInfoGroupsRegex = re.compile(r"^ *([0-9]+) +([0-9]+) +([IRSTUZ])[sA-Z+<>]* +([0-9.,]+) +([0-9.,]+) +(.+?)   +([0-9:-]+) +(.+)$")
+
+# name patterns are matched against the args column of a single process row
+k_psSearch_appname  = "{processname}( -psn_[0-9_]*)?".format
+k_psSearch_helper   = "{processname} ?( -.+)*".format
+k_psSearch_daemon   = "{processname} ?{args}".format
+k_psnSuffixRegex    = re.compile(r" -psn_[0-9_]*$")
+k_regexMetaChars    = frozenset(".^$*+?{}[]\\|()")
 
 k_appOpenCmd        = "/usr/bin/open{background}{fresh} {apppath}".format
 k_appQuitCmd        = "/usr/bin/osascript -e 'tell application \"{processname}\" to quit'".format
@@ -44,9 +60,66 @@ k_killCmd           = "/bin/kill {pid}".format
 
 k_returnFalseCmd    = "/bin/echo {message}; false".format
 
-k_awkSumColumn      = "/bin/echo {data} | /usr/bin/awk '{{s+=${col}}} END {{print s}}'".format
+k_pollFastWindow    = 30    # seconds of fast polling after a command or state change
+k_pollBackoff       = 2.0   # interval multiplier for each stable poll
+
+k_historySize       = 1024  # samples kept per device
+k_historySpacing    = 1.0   # minimum seconds between history samples
+k_historyWindows    = ( ('1m', 60), ('5m', 300), ('15m', 900) )
+
+k_groupCacheSize    = 10000 # process names remembered by the group matcher
+k_groupRefRegex     = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(\d")   # numbered backreferences and (?(n)...)
+
+k_emptyGroupStats   = {'count':0, 'cpu_total':0.0, 'cpu_max':0.0, 'mem_total':0.0, 'mem_max':0.0}
+
+k_relayTypes        = ('application','helper','daemon')
+k_bulkCommands      = { 'launch': 'launched', 'quit': 'quit', 'restart': 'restarted' }
+
+k_fixedPollTypes    = ('sysload','procgroup','health')  # polled every pushStatsFreq
+
+k_loopPhases        = ('sample','parse','index','update','publish','loop')
+k_loopStatsSize     = 600   # timings kept per phase
+
+k_topRankings       = ( ('cpu','pcpu','CPU'), ('mem','pmem','memory') )    # state prefix, row key, label
+
+k_childIndexChurn   = 0.25  # fraction of processes started or exited above which the child index is rebuilt
+
+k_urgentStates      = ('onOffState','process_status')
+# states only published along with the states they are derived from
+k_followerStates    = { 'elapsed_time': ('elapsed_secs',),
+                        'displayState': ('percent_cpu','percent_mem','match_count','cpu_total','mem_total','loop_p95') }
+
+k_exitWatchTimeout  = 0.5   # seconds the exit watcher blocks before checking for new pids
+
+k_snapshotMaxAge    = 0.5   # seconds a snapshot can be reused for on-demand requests
 
-k_countCoresCmd     = "/usr/sbin/sysctl -n hw.ncpu"
+k_confirmPollMin    = 0.05  # seconds between snapshot polls while confirming a command
+k_confirmPollMax    = 1.0
+
+shell_forks         = 0     # commands run by do_shell_script, for diagnostics
+
+# ps prints lstart in the C locale layout "%a %b %e %H:%M:%S %Y"
+k_lstartDays        = ('Mon','Tue','Wed','Thu','Fri','Sat','Sun')
+k_lstartMonths      = ('Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec')
+k_lstartMonthNums   = { month: index+1 for index, month in enumerate(k_lstartMonths) }
+
+k_exportHost        = '127.0.0.1'  # the metrics endpoint is only served on loopback
+# prometheus metric name, help, and the device state it comes from, by device type
+k_exportMetrics     = ( ('macapps_up',                  'Whether the process is running',           ('application','helper','daemon'), 'onOffState'),
+                        ('macapps_cpu_percent',         'Percent CPU used',                         ('application','helper','daemon','sysload'), 'percent_cpu'),
+                        ('macapps_memory_percent',      'Percent memory used',                      ('application','helper','daemon','sysload'), 'percent_mem'),
+                        ('macapps_elapsed_seconds',     'Seconds since the process started',        ('application','helper','daemon'), 'elapsed_secs'),
+                        ('macapps_tree_cpu_percent',    'Percent CPU used with child processes',    ('application','daemon'), 'tree_cpu'),
+                        ('macapps_tree_memory_percent', 'Percent memory used with child processes', ('application','daemon'), 'tree_mem'),
+                        ('macapps_child_processes',     'Number of child processes',                ('application','daemon'), 'child_count'),
+                        ('macapps_group_processes',     'Processes matching the group pattern',     ('procgroup',), 'match_count'),
+                        ('macapps_group_cpu_percent',   'Percent CPU used by the group',            ('procgroup',), 'cpu_total'),
+                        ('macapps_group_memory_percent','Percent memory used by the group',         ('procgroup',), 'mem_total') )
+
+k_procPath          = "/proc"
+# linux process states mapped onto the ps states above (None means skip)
+k_procStateMap      = { 'R':'R', 'S':'S', 'D':'U', 'T':'T', 't':'T', 'Z':'Z', 'I':'I',
+                        'W':'S', 'P':'S', 'K':'U', 'X':None, 'x':None }
 
 ################################################################################
 class Plugin(indigo.PluginBase):
@@ -65,6 +138,18 @@ class Plugin(indigo.PluginBase):
 
         self.stateLoopFreq  = int(self.pluginPrefs.get('stateLoopFreq','10'))
         self.pushStatsFreq  = int(self.pluginPrefs.get('pushStatsFreq','30'))
+        self.scheduler      = PollScheduler(int(self.pluginPrefs.get('pollMinFreq','2')),
+                                            self.stateLoopFreq,
+                                            int(self.pluginPrefs.get('pollMaxFreq','60')))
+        self.publisher      = StatePublisher(self)
+        self.publisher.configure(self.pluginPrefs)
+        self.sampler        = make_sampler(self.pluginPrefs.get('psBackend','ps'))
+        self.discoveryFreq  = int(self.pluginPrefs.get('discoveryFreq','60'))
+        self.cmdTimeout     = int(self.pluginPrefs.get('commandTimeout','30'))
+        self.cmdWorkers     = int(self.pluginPrefs.get('commandWorkers','8'))
+        self.cmdPool        = ThreadPoolExecutor(max_workers=self.cmdWorkers)
+        self.cmdWatcher     = CommandWatcher(self)
+        self.cmdWatcher.start()
         self.cores          = countCores()
         self.divisor        = [1.,self.cores][self.pluginPrefs.get('divideByCores',True)]
         self.debug          = self.pluginPrefs.get('showDebugInfo',False)
@@ -73,14 +158,33 @@ class Plugin(indigo.PluginBase):
             self.logger.debug("Debug logging enabled")
 
         self.deviceDict = dict()
+        self.groupMatcher = GroupMatcher()
+        self.startTimes = StartTimeCache()
+        self.triggerMonitor = TriggerMonitor()
+        self.topCount = 0
+        self.loopStats = NullLoopStats()
+        self.setLoopStats()
 
-        self._psData = ""
-        self._psRefresh = True
+        self._psTable = ProcessTable([])
+        self._psCond = threading.Condition()
+        self._psSampling = False
+        self._lastDiscovery = 0
+
+        self.exitWatcher = None
+        self.setExitWatcher(self.pluginPrefs.get('watchExits',True))
+
+        # the exporter renders the current snapshot as soon as it starts
+        self.exporter = None
+        self.setExporter(self.pluginPrefs)
 
     #------------------------------------------------------------------------------
     def shutdown(self):
         self.logger.debug("shutdown")
         self.pluginPrefs["showDebugInfo"] = self.debug
+        self.cmdPool.shutdown(wait=False)
+        self.cmdWatcher.stop()
+        self.setExitWatcher(False)
+        self.setExporter(dict())
 
     #------------------------------------------------------------------------------
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
@@ -88,6 +192,25 @@ class Plugin(indigo.PluginBase):
         if not userCancelled:
             self.stateLoopFreq  = int(valuesDict['stateLoopFreq'])
             self.pushStatsFreq  = int(valuesDict['pushStatsFreq'])
+            self.publisher.configure(valuesDict)
+            self.scheduler.setIntervals(int(valuesDict.get('pollMinFreq','2')),
+                                        self.stateLoopFreq,
+                                        int(valuesDict.get('pollMaxFreq','60')))
+            for devId, dev in self.deviceDict.items():
+                if dev.type in k_fixedPollTypes:
+                    self.scheduler.add(devId, self.pushStatsFreq)
+            self.discoveryFreq  = int(valuesDict.get('discoveryFreq','60'))
+            self.cmdTimeout     = int(valuesDict.get('commandTimeout','30'))
+            if int(valuesDict.get('commandWorkers','8')) != self.cmdWorkers:
+                self.cmdWorkers = int(valuesDict.get('commandWorkers','8'))
+                self.cmdPool.shutdown(wait=False)
+                self.cmdPool    = ThreadPoolExecutor(max_workers=self.cmdWorkers)
+            if valuesDict.get('psBackend','ps') != self.sampler.name:
+                self.sampler    = make_sampler(valuesDict.get('psBackend','ps'))
+                self.snapshot(0)
+            self.setExitWatcher(valuesDict.get('watchExits',True))
+            self.setLoopStats(valuesDict)
+            self.setExporter(valuesDict)
             self.divisor        = [1.,self.cores][valuesDict['divideByCores']]
             self.logger.debug("divisor: "+str(self.divisor))
             self.debug          = valuesDict['showDebugInfo']
@@ -99,6 +222,29 @@ class Plugin(indigo.PluginBase):
         self.logger.debug("validatePrefsConfigUi")
         errorsDict = indigo.Dict()
 
+        if valuesDict.get('psBackend','ps') == 'proc' and not os.path.isdir(k_procPath):
+            errorsDict['psBackend'] = f"{k_procPath} is not available on this system"
+
+        if valuesDict.get('exportMode','none') == 'http':
+            try:
+                if not 1024 <= int(valuesDict.get('exportPort','9756')) <= 65535:
+                    errorsDict['exportPort'] = "Must be between 1024 and 65535"
+            except ValueError:
+                errorsDict['exportPort'] = "Must be a number"
+        elif valuesDict.get('exportMode','none') == 'file':
+            exportPath = os.path.expanduser(valuesDict.get('exportPath',''))
+            if not exportPath.strip():
+                errorsDict['exportPath'] = "Required"
+            elif os.path.isdir(exportPath):
+                errorsDict['exportPath'] = "Must be a file, not a folder"
+            elif not os.path.isdir(os.path.dirname(os.path.abspath(exportPath))):
+                errorsDict['exportPath'] = "Folder does not exist"
+
+        if int(valuesDict.get('pollMinFreq','2')) > int(valuesDict['stateLoopFreq']):
+            errorsDict['pollMinFreq'] = "Must not be longer than the update frequency"
+        if int(valuesDict.get('pollMaxFreq','60')) < int(valuesDict['stateLoopFreq']):
+            errorsDict['pollMaxFreq'] = "Must not be shorter than the update frequency"
+
         if len(errorsDict) > 0:
             self.logger.debug(f'validate prefs config error: \n{str(errorsDict)}')
             return (False, valuesDict, errorsDict)
@@ -106,35 +252,153 @@ class Plugin(indigo.PluginBase):
 
     #------------------------------------------------------------------------------
     def runConcurrentThread(self):
-        lastPushStats = 0
-        self.sleep(self.stateLoopFreq)
         try:
             while True:
                 loopStart = time.time()
-                doPushStats = loopStart >= lastPushStats  + self.pushStatsFreq
-
-                self.refresh_data()
-                for devId, dev in self.deviceDict.items():
-                    dev.update(doPushStats)
-
-                lastPushStats = [lastPushStats, loopStart][doPushStats]
+                dueIds = self.scheduler.due(loopStart)
+
+                # no sample at all on ticks where nothing is due, and only the
+                # known pids when every due device is already bound to one
+                if dueIds:
+                    stats = self.loopStats
+                    pids = set()
+                    for devId in dueIds:
+                        dev = self.deviceDict.get(devId)
+                        devPids = dev.samplePids() if dev else set()
+                        if devPids is None:
+                            pids = None
+                            break
+                        pids.update(devPids)
+                    if pids is None or pids:
+                        self.snapshot(k_snapshotMaxAge, pids)
+                    for devId in dueIds:
+                        dev = self.deviceDict.get(devId)
+                        if dev:
+                            start = stats.start()
+                            changed = dev.update(self.scheduler.statsDue(devId, loopStart, self.pushStatsFreq))
+                            stats.record('update', start)
+                            self.scheduler.reschedule(devId, loopStart, changed)
+                    self.publisher.flush()
+                    if self.exporter:
+                        self.exporter.update(self.psResults, self.deviceDict)
+                    elapsed = time.time() - loopStart
+                    stats.record('loop', elapsed=elapsed)
+                    if elapsed > self.stateLoopFreq:
+                        stats.count('overruns')
+                else:
+                    self.publisher.flush()
 
-                self.sleep( loopStart + self.stateLoopFreq - time.time() )
+                # wake at least every min interval so boosted devices are picked up
+                self.sleep( min(self.scheduler.nextDue(), loopStart + self.scheduler.minInterval) - time.time() )
         except self.StopThread:
             pass    # Optionally catch the StopThread exception and do any needed cleanup.
 
+    #------------------------------------------------------------------------------
+    def setExitWatcher(self, enable):
+        if enable and not self.exitWatcher:
+            self.exitWatcher = make_exit_watcher(self.onProcessExit, self.logger)
+            if self.exitWatcher:
+                self.exitWatcher.start()
+                for dev in self.deviceDict.values():
+                    dev.update()    # registers running processes
+            else:
+                self.logger.debug("process exit notifications not available, using polling only")
+        elif not enable and self.exitWatcher:
+            self.exitWatcher.stop()
+            self.exitWatcher = None
+
+    #------------------------------------------------------------------------------
+    def setExporter(self, prefs):
+        mode = prefs.get('exportMode','none')
+        target = [prefs.get('exportPort','9756'), prefs.get('exportPath','')][mode == 'file']
+        if self.exporter and (self.exporter.mode, self.exporter.target) == (mode, target):
+            return
+        if self.exporter:
+            self.exporter.stop()
+            self.exporter = None
+        if mode in ('http','file'):
+            try:
+                self.exporter = MetricsExporter(mode, target, self.logger)
+                self.exporter.start()
+                self.exporter.update(self.psResults, self.deviceDict)
+            except (IOError, OSError, ValueError) as e:
+                self.logger.error(f'unable to start the metrics exporter: {e}')
+                self.exporter = None
+
+    #------------------------------------------------------------------------------
+    def onProcessExit(self, devId, pid):
+        # called on the exit watcher thread
+        dev = self.deviceDict.get(devId)
+        if dev:
+            dev.processExited(pid)
+            self.scheduler.boost(devId)
+
     #------------------------------------------------------------------------------
     @property
     def psResults(self):
-        if self._psRefresh:
-            success, data = do_shell_script(k_psGetDataCmd)
-            if success:
-                self._psData = data.decode('utf-8')
-                self._psRefresh = False
-        return self._psData
+        # latest snapshot; tables are never changed once published
+        return self._psTable
 
-    def refresh_data(self):
-        self._psRefresh = True
+    #------------------------------------------------------------------------------
+    def snapshot(self, maxAge=k_snapshotMaxAge, pids=None):
+        # Returns a snapshot taken no more than maxAge seconds before the call.  pids
+        # allows a targeted sample of just those processes.  Callers that arrive while
+        # a sample is in flight wait for it and share the result instead of forking.
+        requested = time.time()
+        with self._psCond:
+            while True:
+                psTable = self._psTable
+                if psTable.timestamp >= requested - maxAge and psTable.covers(pids):
+                    return psTable
+                if not self._psSampling:
+                    break
+                self._psCond.wait()
+                if self._psTable is not psTable and self._psTable.covers(pids):
+                    return self._psTable
+            self._psSampling = True
+        psTable = None
+        try:
+            psTable = self._sample(pids)
+        finally:
+            with self._psCond:
+                if psTable:
+                    self._psTable = psTable
+                self._psSampling = False
+                self._psCond.notify_all()
+        if psTable and self.debug:
+            self.logger.debug(f'snapshot {psTable.generation} ({["full","targeted"][psTable.partial]}): '
+                              f'{len(psTable.rows)} processes, {len(psTable.started)} started, {len(psTable.exited)} exited')
+        return self._psTable
+
+    #------------------------------------------------------------------------------
+    def _sample(self, pids):
+        # only ever called by one thread at a time, from snapshot()
+        timestamp = time.time()
+        previous = self._psTable
+        stats = self.loopStats
+        if pids and timestamp < self._lastDiscovery + self.discoveryFreq:
+            success, records = self.sampler.sample(pids, stats)
+            if success:
+                start = stats.start()
+                psTable = ProcessTable(records, previous, partial=True, timestamp=timestamp)
+                stats.record('index', start)
+                # any pid gone or replaced means a full discovery scan right away; checked
+                # against the identities of the last full scan, as a targeted byPid is partial
+                for pid in pids:
+                    row = psTable.byPid.get(pid)
+                    if not row or (pid, row['lstart']) not in previous.identities:
+                        break
+                else:
+                    return psTable
+        success, records = self.sampler.sample(None, stats)
+        if success:
+            self._lastDiscovery = timestamp
+            start = stats.start()
+            psTable = ProcessTable(records, previous, timestamp=timestamp, topCount=self.topCount)
+            stats.record('index', start)
+            self.startTimes.evict(psTable.exited)
+            return psTable
+        return None
 
     #------------------------------------------------------------------------------
     # Device Methods
@@ -144,6 +408,8 @@ class Plugin(indigo.PluginBase):
         if dev.version != self.pluginVersion:
             self.updateDeviceVersion(dev)
         if dev.configured:
+            # scheduled before it's visible, so the loop never finds a device without an entry
+            self.scheduler.add(dev.id, [None,self.pushStatsFreq][dev.deviceTypeId in k_fixedPollTypes])
             if dev.deviceTypeId == 'application':
                 self.deviceDict[dev.id] = ApplicationDevice(dev, self)
             elif dev.deviceTypeId == 'helper':
@@ -152,20 +418,101 @@ class Plugin(indigo.PluginBase):
                 self.deviceDict[dev.id] = DaemonDevice(dev, self)
             elif dev.deviceTypeId == 'sysload':
                 self.deviceDict[dev.id] = SystemLoadDevice(dev, self)
+                dev.stateListOrDisplayStateIdChanged()  # top process states depend on the count
+                self.setTopCount()
+            elif dev.deviceTypeId == 'health':
+                self.deviceDict[dev.id] = HealthDevice(dev, self)
+                self.setLoopStats()
+            elif dev.deviceTypeId == 'procgroup':
+                self.deviceDict[dev.id] = ProcessGroupDevice(dev, self)
+                self.groupMatcher.add(dev.id, dev.pluginProps['pattern'], dev.pluginProps.get('patternType','glob'))
+            self.snapshot([k_snapshotMaxAge,0][self.psResults.topCount < self.topCount])
             self.deviceDict[dev.id].update(True)
+            self.publisher.flush()
 
     #------------------------------------------------------------------------------
     def deviceStopComm(self, dev):
         self.logger.debug("deviceStopComm: "+dev.name)
         if dev.id in self.deviceDict:
             del self.deviceDict[dev.id]
+            self.setTopCount()
+            self.setLoopStats()
+        self.scheduler.remove(dev.id)
+        self.cmdWatcher.discard(dev.id)
+        self.publisher.discard(dev.id)
+        self.groupMatcher.remove(dev.id)
+        if self.exitWatcher:
+            self.exitWatcher.unwatch(dev.id)
+
+    #------------------------------------------------------------------------------
+    # Trigger Methods
+    #------------------------------------------------------------------------------
+    def triggerStartProcessing(self, trigger):
+        self.logger.debug("triggerStartProcessing: "+trigger.name)
+        self.triggerMonitor.add(trigger)
+
+    #------------------------------------------------------------------------------
+    def triggerStopProcessing(self, trigger):
+        self.logger.debug("triggerStopProcessing: "+trigger.name)
+        self.triggerMonitor.remove(trigger)
+
+    #------------------------------------------------------------------------------
+    def validateEventConfigUi(self, valuesDict, typeId, eventId):
+        errorsDict = indigo.Dict()
+        if not valuesDict.get('deviceId',''):
+            errorsDict['deviceId'] = "Required"
+        for key in ('threshold','duration','hysteresis'):
+            if key in valuesDict:
+                try:
+                    if float(valuesDict[key]) < 0:
+                        errorsDict[key] = "Must not be negative"
+                except ValueError:
+                    errorsDict[key] = "Must be a number"
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
+    #------------------------------------------------------------------------------
+    def setTopCount(self):
+        # snapshots rank as many processes as the largest system load device wants
+        self.topCount = max([dev.topCount for dev in self.deviceDict.values() if dev.type == 'sysload'] or [0])
+
+    #------------------------------------------------------------------------------
+    def setLoopStats(self, prefs=None):
+        # instrumentation runs when enabled in prefs or when a health device needs it
+        prefs = prefs or self.pluginPrefs
+        enable = prefs.get('instrumentLoop',False) or any(dev.type == 'health' for dev in self.deviceDict.values())
+        if enable and not self.loopStats.enabled:
+            self.loopStats = LoopStats(self.publisher)
+        elif not enable and self.loopStats.enabled:
+            self.loopStats = NullLoopStats()
+
+    #------------------------------------------------------------------------------
+    def getDeviceStateList(self, dev):
+        stateList = indigo.PluginBase.getDeviceStateList(self, dev)
+        if dev.deviceTypeId == 'sysload':
+            for rank in range(1, int(dev.pluginProps.get('topCount','0'))+1):
+                for prefix, rowKey, label in k_topRankings:
+                    stateList.append(self.getDeviceStateDictForStringType(f'top_{prefix}_{rank}_name', f'Top {label} process {rank} name', f'Top {label} process {rank} name'))
+                    stateList.append(self.getDeviceStateDictForStringType(f'top_{prefix}_{rank}_pid', f'Top {label} process {rank} pid', f'Top {label} process {rank} pid'))
+                    stateList.append(self.getDeviceStateDictForNumberType(f'top_{prefix}_{rank}_value', f'Top {label} process {rank} percent', f'Top {label} process {rank} percent'))
+        return stateList
 
     #------------------------------------------------------------------------------
     def validateDeviceConfigUi(self, valuesDict, deviceTypeId, devId, runtime=False):
         self.logger.debug("validateDeviceConfigUi: " + deviceTypeId)
         errorsDict = indigo.Dict()
 
-        if deviceTypeId != 'sysload':
+        if deviceTypeId == 'procgroup':
+            if not valuesDict.get('pattern',''):
+                errorsDict['pattern'] = "Required"
+            elif valuesDict.get('patternType','glob') == 'regex':
+                try:
+                    re.compile(valuesDict['pattern'])
+                except re.error as e:
+                    errorsDict['pattern'] = f"Invalid regular expression: {e}"
+
+        elif deviceTypeId not in ('sysload','health'):
             if not valuesDict.get('applicationName',''):
                 errorsDict['applicationName'] = "Required"
 
@@ -228,14 +575,156 @@ class Plugin(indigo.PluginBase):
         # STATUS REQUEST
         elif action.deviceAction == indigo.kUniversalAction.RequestStatus:
             self.logger.info(f'"{dev.name}" status update')
-            self.refresh_data()
+            self.snapshot(k_snapshotMaxAge)
             appDev.update(True)
         # UNKNOWN
         else:
             self.logger.debug(f'"{dev.name}" {str(action.deviceAction)} request ignored')
 
+    #-------------------------------------------------------------------------------
+    def bulkLaunch(self, action):
+        self.bulkCommand(action, 'launch')
+
+    def bulkQuit(self, action):
+        self.bulkCommand(action, 'quit')
+
+    def bulkRestart(self, action):
+        self.bulkCommand(action, 'restart')
+
+    #-------------------------------------------------------------------------------
+    def bulkCommand(self, action, command):
+        devices = list()
+        for devId in action.props.get('devices',[]):
+            device = self.deviceDict.get(int(devId))
+            if device and device.type in k_relayTypes:
+                devices.append(device)
+            else:
+                self.logger.error(f'{command}: device {devId} is not an enabled application, helper or daemon device')
+        if devices:
+            # don't hold up the action thread while the commands run
+            self.cmdPool.submit(self.runBulkCommand, devices, command, int(action.props.get('concurrency','4')))
+
+    #-------------------------------------------------------------------------------
+    def runBulkCommand(self, devices, command, limit):
+        # Sends the commands up to limit at a time, then confirms every device from
+        # the same snapshots, so the whole set takes about as long as its slowest member.
+        start = time.time()
+        newState = command != 'quit'
+        results = dict()
+        sent = list()
+        try:
+            with ThreadPoolExecutor(max_workers=max(limit,1)) as pool:
+                for device, pending in zip(devices, pool.map(lambda device: self._bulkSend(device, command, results), devices)):
+                    if pending:
+                        sent.append(device)
+            confirmed = self._bulkConfirm(sent, newState, self.cmdTimeout, start)
+            for device in sent:
+                if device.dev.id in confirmed:
+                    results[device.dev.id] = f'{k_bulkCommands[command]} in {confirmed[device.dev.id]:.1f} sec'
+                else:
+                    results[device.dev.id] = f'did not {["quit","launch"][newState]} within {self.cmdTimeout} seconds'
+        except Exception:
+            self.logger.exception(f'error running {command} command')
+        finally:
+            for device in sent:
+                device.endCommand()
+        succeeded = sum(result.startswith(k_bulkCommands[command]) for result in results.values())
+        self.logger.info(f'{command}: {succeeded} of {len(devices)} devices {k_bulkCommands[command]}, {time.time()-start:.1f} sec total')
+        for device in devices:
+            self.logger.info(f'{device.name:>30}: {results.get(device.dev.id, "not run")}')
+        return results
+
+    #-------------------------------------------------------------------------------
+    def _bulkSend(self, device, command, results):
+        # runs on the bulk command's own pool; True if the device is left pending confirmation
+        newState = command != 'quit'
+        devId = device.dev.id
+        try:
+            if command == 'restart' and device.onState:
+                if not device.beginCommand(False):
+                    results[devId] = "busy with another command"
+                    return False
+                quit = device.sendCommand(False) and device.confirmState(False, self.cmdTimeout)
+                device.endCommand()
+                if not quit:
+                    results[devId] = "did not quit"
+                    return False
+            elif device.onState == newState:
+                results[devId] = f'already {["off","on"][newState]}'
+                return False
+            if not device.beginCommand(newState):
+                results[devId] = "busy with another command"
+                return False
+            if not device.sendCommand(newState):
+                results[devId] = "command failed"
+                device.endCommand()
+                return False
+            return True
+        except Exception:
+            self.logger.exception(f'error running {command} command for "{device.name}"')
+            results[devId] = "error"
+            device.endCommand()
+            return False
+
+    #-------------------------------------------------------------------------------
+    def _bulkConfirm(self, devices, newState, timeout, start):
+        # seconds from start until each device that made it reached newState
+        deadline = time.time() + timeout
+        interval = k_confirmPollMin
+        waiting = list(devices)
+        confirmed = dict()
+        while waiting:
+            self.snapshot(0)
+            for device in list(waiting):
+                device.update(True)
+                if device.onState == newState:
+                    confirmed[device.dev.id] = time.time() - start
+                    waiting.remove(device)
+            if not waiting or time.time() + interval > deadline:
+                break
+            time.sleep(interval)
+            interval = min(interval*2, k_confirmPollMax)
+        return confirmed
+
+    #-------------------------------------------------------------------------------
+    def relayDeviceList(self, filter="", valuesDict=None, typeId="", targetId=0):
+        # application, helper and daemon devices, for the bulk action device lists
+        return sorted([(str(devId), device.name) for devId, device in self.deviceDict.items() if device.type in k_relayTypes], key=lambda item: item[1].lower())
+
+    #-------------------------------------------------------------------------------
+    def validateActionConfigUi(self, valuesDict, typeId, devId):
+        errorsDict = indigo.Dict()
+        if typeId in ('bulkLaunch','bulkQuit','bulkRestart') and not valuesDict.get('devices'):
+            errorsDict['devices'] = "Select at least one device"
+        if len(errorsDict) > 0:
+            return (False, valuesDict, errorsDict)
+        return (True, valuesDict)
+
     #-------------------------------------------------------------------------------
     # Menu Methods
+    #-------------------------------------------------------------------------------
+    def logSchedule(self):
+        now = time.time()
+        self.logger.info("polling schedule:")
+        for devId, dev in self.deviceDict.items():
+            entry = self.scheduler.cadence(devId)
+            if entry:
+                fast = [" (fast)",""][entry['fastUntil'] <= now]
+                self.logger.info(f'{dev.name:>30}: every {entry["interval"]:g} sec{fast}, next in {max(entry["due"]-now,0):.1f} sec')
+
+    #-------------------------------------------------------------------------------
+    def logPublishing(self):
+        self.logger.info(f'states published: {self.publisher.published}, suppressed: {self.publisher.suppressed}')
+
+    #-------------------------------------------------------------------------------
+    def logDiagnostics(self):
+        if not self.loopStats.enabled:
+            self.logger.info("loop instrumentation is off; enable it in the plugin config or add a Plugin Health device")
+            return
+        self.logger.info("polling loop diagnostics:")
+        for line in self.loopStats.report():
+            self.logger.info(line)
+
     #-------------------------------------------------------------------------------
     def toggleDebug(self):
         if self.debug:
@@ -263,41 +752,116 @@ class ApplicationBase(object):
         self.logger     = plugin.logger
 
         self._refresh   = True
-        self._psInfo    = ""
-        self._pid       = ""
+        self._psInfo    = None
+        self._lstart    = None
+        self._seenGen   = None
+        self._bound     = None
+        self._exited    = None
+        self._pending   = None
+        self._lock      = threading.RLock()
+        self._primed    = False
+        self.history    = SampleHistory()
+        self.treeAccounting = self.props.get('treeAccounting', False)
 
     #------------------------------------------------------------------------------
     def update(self, doStats=False):
+        with self._lock:
+            return self._update(doStats)
+
+    #------------------------------------------------------------------------------
+    def processExited(self, pid):
+        # exit notification for a bound process; turn off now rather than at the next poll
+        with self._lock:
+            if pid == self.pid:
+                self._exited = (pid, time.time())
+                self._update(True)
+
+    #------------------------------------------------------------------------------
+    def _update(self, doStats):
+        # updates from outside the loop can find a targeted snapshot of other devices' pids
+        pids = self.samplePids()
+        if not self.plugin.psResults.covers(pids):
+            self.plugin.snapshot(k_snapshotMaxAge, pids)
         self._refresh = True
 
         self.states['onOffState'] = bool(self.psInfo)
+        newProcess = self.onState and (self.psInfo['pid'], self.psInfo['lstart']) != self._bound
+        previous = self._bound
+        quitting = self._pending is False
 
-        if doStats or (self.onState != self.dev.onState):
+        if doStats or newProcess or (self.onState != self.dev.onState):
             if self.onState:
-                stats = re_extract(self.psInfo, k_psInfoGroupsRegex, k_psInfoGroupsKeys)
+                stats = self.psInfo
+                started = self.plugin.startTimes.get(stats['pid'], stats['lstart'])
                 self.status                 = stats['state']
-                self.states['process_id']   = stats['pid']
-                self.states['last_start']   = lstart_to_timestamp(stats['lstart'])
-                self.states['elapsed_time'] = stats['etime']
-                self.states['elapsed_secs'] = etime_to_seconds(stats['etime'])
-                self.states['percent_cpu']  = float(stats['pcpu'])/self.plugin.divisor
-                self.states['percent_mem']  = float(stats['pmem'])
+                if newProcess:
+                    # start time only changes with the process
+                    self._bound                 = (stats['pid'], stats['lstart'])
+                    self.states['process_id']   = stats['pid']
+                    self.states['last_start']   = str(datetime.fromtimestamp(started)) if started else ''
+                    self.history.reset()
+                timestamp = self.plugin.psResults.timestamp
+                if started and timestamp:
+                    self.states['elapsed_secs'] = int(max(timestamp - started, 0))
+                else:
+                    self.states['elapsed_secs'] = etime_to_seconds(stats['etime'])
+                self.states['elapsed_time'] = seconds_to_etime(self.states['elapsed_secs'])
+                self.states['percent_cpu']  = stats['pcpu']/self.plugin.divisor
+                self.states['percent_mem']  = stats['pmem']
+                if self.treeAccounting:
+                    cpu, mem, count = self.plugin.psResults.treeTotals(stats['pid'])
+                    self.states['tree_cpu']     = cpu/self.plugin.divisor
+                    self.states['tree_mem']     = mem
+                    self.states['child_count']  = count
             else:
                 self.status                 = 'X'
+                self._bound                 = None
                 self.states['process_id']   = ''
                 self.states['elapsed_time'] = ''
                 self.states['elapsed_secs'] = 0
                 self.states['percent_cpu']  = 0.0
                 self.states['percent_mem']  = 0.0
+                if self.treeAccounting:
+                    self.states['tree_cpu']     = 0.0
+                    self.states['tree_mem']     = 0.0
+                    self.states['child_count']  = 0
+                self.history.reset()
+            if self._pending is not None:
+                if self._pending == self.onState:
+                    self._pending = None
+                else:
+                    self.status = ['Q','L'][self._pending]
             self.states['process_status']   = k_processStatusDict[self.status]['txt']
 
+        # events see every sample, whatever gets published; nothing fires on the first one
+        if self._primed:
+            timestamp = [time.time(), self.plugin.psResults.timestamp][self.onState and bool(self.plugin.psResults.timestamp)]
+            self.plugin.triggerMonitor.evaluate(self.dev.id, timestamp,
+                                                started     = newProcess,
+                                                exited      = bool(previous) and (not self.onState or newProcess),
+                                                expected    = quitting,
+                                                cpu         = self.psInfo['pcpu']/self.plugin.divisor if self.onState else 0.0,
+                                                mem         = self.psInfo['pmem'] if self.onState else 0.0)
+        self._primed = True
+
+        # history is filled from every sample, not just stats pushes
+        if self.onState and self._bound:
+            self.history.add(self.plugin.psResults.timestamp or time.time(),
+                             self.psInfo['pcpu']/self.plugin.divisor, self.psInfo['pmem'])
+        if doStats:
+            for key, value in self.history.states().items():
+                self.states[key] = value
+
         newStates = []
+        devStates = self.dev.states
         for key, value in self.states.iteritems():
-            if self.states[key] != self.dev.states[key]:
-                if key in ['percent_cpu','percent_mem']:
-                    newStates.append({'key':key,'value':value, 'uiValue': '{value}%', 'decimalPlaces':1})
+            if value != devStates.get(key):
+                if key in ['percent_cpu','percent_mem','tree_cpu','tree_mem'] or key in self.history.keys:
+                    newStates.append({'key':key,'value':value, 'uiValue': f'{value:.1f}%', 'decimalPlaces':1})
+                elif key == 'mem_slope':
+                    newStates.append({'key':key,'value':value, 'uiValue': f'{value:+.2f}%/hr', 'decimalPlaces':2})
                 elif key == 'elapsed_secs':
-                    newStates.append({'key':key,'value':value, 'uiValue': '{value} sec'})
+                    newStates.append({'key':key,'value':value, 'uiValue': f'{value} sec'})
                 else:
                     newStates.append({'key':key,'value':value})
 
@@ -306,13 +870,14 @@ class ApplicationBase(object):
                 elif key == 'process_status':
                     self.dev.updateStateImageOnServer(k_processStatusDict[self.status]['img'])
 
-        if len(newStates) > 0:
-            if self.plugin.debug: # don't fill up plugin log unless actively debugging
-                self.logger.debug(f'updating states on device "{self.name}":')
-                for item in newStates:
-                    self.logger.debug(f'{item["key"]:>16}: {value}')
-            self.dev.updateStatesOnServer(newStates)
-            self.states = self.dev.states
+        if self.plugin.exitWatcher:
+            if self.onState:
+                self.plugin.exitWatcher.watch(self.dev.id, self.states['process_id'])
+            else:
+                self.plugin.exitWatcher.unwatch(self.dev.id)
+
+        # tell the scheduler whether anything other than stats changed
+        return self.plugin.publisher.submit(self, newStates)
 
     #------------------------------------------------------------------------------
     # Class Properties
@@ -322,47 +887,109 @@ class ApplicationBase(object):
 
     def onStateSet(self,newState):
         if newState != self.onState:
-            success, response = do_shell_script([self.offCmd,self.onCmd][newState])
-            if success:
-                self.logger.info(f'{["quitting","launching"][newState]} {self.type} "{self.props["applicationName"]}"')
-                self.plugin.refresh_data()
-                self.plugin.sleep(0.25)
-                self.update(True)
+            if self.beginCommand(newState):
+                self.plugin.cmdPool.submit(self.runCommand, newState)
             else:
-                self.logger.error(f'failed to {["quit","launch"][newState]} {self.type} "{self.props["applicationName"]}"')
-                self.logger.debug(response)
+                self.logger.info(f'"{self.name}" {["off","on"][newState]} request ignored, another command is still pending')
 
     onState = property(onStateGet, onStateSet)
 
+    #------------------------------------------------------------------------------
+    def runCommand(self, newState):
+        # runs on the plugin's command pool; the command watcher confirms the result
+        try:
+            if self.sendCommand(newState):
+                self.plugin.cmdWatcher.add(self, newState, self.plugin.cmdTimeout)
+                return
+        except Exception:
+            self.logger.exception(f'error running command for "{self.name}"')
+        self.endCommand()
+
+    #------------------------------------------------------------------------------
+    def beginCommand(self, newState):
+        # shows launching or quitting; False if another command is already pending
+        with self._lock:
+            if self._pending is not None:
+                return False
+            self._pending = newState
+            self.update(True)
+        return True
+
+    #------------------------------------------------------------------------------
+    def sendCommand(self, newState):
+        success, response = do_shell_script([self.offCmd,self.onCmd][newState], self.plugin.cmdTimeout)
+        if success:
+            self.logger.info(f'{["quitting","launching"][newState]} {self.type} "{self.props["applicationName"]}"')
+            self.plugin.scheduler.boost(self.dev.id)
+        else:
+            self.logger.error(f'failed to {["quit","launch"][newState]} {self.type} "{self.props["applicationName"]}"')
+            self.logger.debug(response)
+        return success
+
+    #------------------------------------------------------------------------------
+    def endCommand(self):
+        with self._lock:
+            self._pending = None
+            self.update(True)
+
+    #------------------------------------------------------------------------------
+    def confirmState(self, newState, timeout):
+        # poll fresh snapshots until the process appears or goes away
+        deadline = time.time() + timeout
+        interval = k_confirmPollMin
+        while True:
+            self.plugin.snapshot(0)
+            self.update(True)
+            if self.onState == newState:
+                return True
+            if time.time() + interval > deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval*2, k_confirmPollMax)
+
     #------------------------------------------------------------------------------
     @property
     def psInfo(self):
         if self._refresh:
-            match = re.search(self.psPattern, self.plugin.psResults, re.MULTILINE)
-            if match:
-                self._psInfo = match.group(0)
-            else:
-                self._psInfo = ""
+            psTable = self.plugin.psResults
+            row = None
+            if self.pid:
+                # bound devices only need the pid lookup, unless the process was replaced
+                row = psTable.findPid(self.pid)
+                if row and row['lstart'] != self._lstart and self._lstart is not None:
+                    row = None
+                if not row:
+                    self._seenGen = None
+            if not row:
+                # unresolved devices only look at new processes, once they have seen a full table
+                if self._seenGen is not None and psTable.generation - self._seenGen in (0,1):
+                    row = self.findProcess(psTable.startedTable)
+                else:
+                    row = self.findProcess(psTable)
+            self._seenGen = psTable.generation
+            if row and self._exited and row['pid'] == self._exited[0]:
+                # snapshots taken before an exit notification still list the process
+                if psTable.timestamp < self._exited[1]:
+                    row = None
+                    self._seenGen = None
+                else:
+                    self._exited = None
+            self._lstart = row['lstart'] if row else None
+            self._psInfo = row
             self._refresh = False
         return self._psInfo
 
     #------------------------------------------------------------------------------
     @property
-    def psPattern(self):
-        if self.pid:
-            return self.pidPattern
-        else:
-            return self.namePattern
+    def pid(self):
+        return [ "", self.states['process_id'] ][self.onState]
 
     #------------------------------------------------------------------------------
-    @property
-    def pid(self):
-        pid = [ "", self.states['process_id'] ][self.onState]
-        if pid != self._pid:
-            if pid:
-                self.pidPattern = k_psSearch_pid(pid = pid)
-            self._pid = pid
-        return pid
+    def samplePids(self):
+        # pids this device needs sampled, None if it needs a full scan
+        if self.treeAccounting:
+            return None     # children can start at any time
+        return {self.pid} if self.pid else None
 
     #------------------------------------------------------------------------------
     @property
@@ -381,12 +1008,15 @@ class ApplicationDevice(ApplicationBase):
     def __init__(self, instance, plugin):
         super(ApplicationDevice, self).__init__(instance, plugin)
 
-        self.namePattern    = k_psSearch_appname(   processname = self.props['processName'] )
         self.onCmd          = k_appOpenCmd(         background  = ['',' -g'][self.props.get('openBackground',True)],
                                                     fresh       = ['',' -F'][self.props.get('openFresh',True)],
                                                     apppath     = cmd_quote(self.props['applicationPath']) )
         self.defaultOffCmd  = k_appQuitCmd(         processname = self.props['processName'])
 
+    #-------------------------------------------------------------------------------
+    def findProcess(self, psTable):
+        return psTable.findAppName(self.props['processName'])
+
 ###############################################################################
 class HelperDevice(ApplicationBase):
 
@@ -394,12 +1024,15 @@ class HelperDevice(ApplicationBase):
     def __init__(self, instance, plugin):
         super(HelperDevice, self).__init__(instance, plugin)
 
-        self.namePattern    = k_psSearch_helper(    processname = self.props['processName'] )
         self.onCmd          = k_appOpenCmd(         background  = ['',' -g'][self.props.get('openBackground',True)],
                                                     fresh       = ['',' -F'][self.props.get('openFresh',True)],
                                                     apppath     = cmd_quote(self.props['applicationPath']) )
         self.defaultOffCmd  = k_returnFalseCmd(     message = "command not available")
 
+    #-------------------------------------------------------------------------------
+    def findProcess(self, psTable):
+        return psTable.findHelper(self.props['processName'])
+
 ###############################################################################
 class DaemonDevice(ApplicationBase):
 
@@ -407,13 +1040,15 @@ class DaemonDevice(ApplicationBase):
     def __init__(self, instance, plugin):
         super(DaemonDevice, self).__init__(instance, plugin)
 
-        self.namePattern    = k_psSearch_daemon(    processname = self.props['processName'],
-                                                    args        = self.props['startArgs']   )
         self.onCmd          = k_daemonStartCmd(     processname = cmd_quote(self.props['processName']),
                                                     apppath     = cmd_quote(self.props['applicationPath']),
                                                     args        = cmd_quote(self.props['startArgs']) )
         self.defaultOffCmd  = k_daemonStopCmd(      processname = cmd_quote(self.props['processName']))
 
+    #-------------------------------------------------------------------------------
+    def findProcess(self, psTable):
+        return psTable.findDaemon(self.props['processName'], self.props['startArgs'])
+
 ###############################################################################
 class SystemLoadDevice(object):
 
@@ -428,29 +1063,44 @@ class SystemLoadDevice(object):
         self.plugin     = plugin
         self.logger     = plugin.logger
 
+        self.topCount   = int(self.props.get('topCount','0'))
+        self._ranking   = None
+
     #------------------------------------------------------------------------------
     def update(self, doStats=False):
         if doStats:
-            psData = self.plugin.psResults
-            self.states['percent_cpu']  = sumColumn(psData, k_psInfoGroupsKeys.index('pcpu'))/self.plugin.divisor
-            self.states['percent_mem']  = sumColumn(psData, k_psInfoGroupsKeys.index('pmem'))
+            psTable = self.plugin.psResults
+            self.states['percent_cpu']  = psTable.totalCpu/self.plugin.divisor
+            self.states['percent_mem']  = psTable.totalMem
             self.states['displayState'] = f"{self.states['percent_cpu']:.1f}% | {self.states['percent_mem']:.1f}%"
 
+            # top process states only change when the ranking does
+            ranking = tuple(tuple((row['pid'],row['args']) for row in psTable.top[rowKey][:self.topCount]) for prefix, rowKey, label in k_topRankings)
+            if self.topCount and ranking != self._ranking:
+                self._ranking = ranking
+                for prefix, rowKey, label in k_topRankings:
+                    rows = psTable.top[rowKey][:self.topCount]
+                    for rank in range(1, self.topCount+1):
+                        row = rows[rank-1] if rank <= len(rows) else None
+                        self.states[f'top_{prefix}_{rank}_name']  = row['args'] if row else ''
+                        self.states[f'top_{prefix}_{rank}_pid']   = row['pid'] if row else ''
+                        self.states[f'top_{prefix}_{rank}_value'] = (row[rowKey]/[1.,self.plugin.divisor][rowKey == 'pcpu']) if row else 0.0
+
             newStates = list()
+            devStates = self.dev.states
             for key, value in self.states.iteritems():
-                if self.states[key] != self.dev.states[key]:
-                    if key in ['percent_cpu','percent_mem']:
-                        newStates.append({'key':key,'value':value, 'uiValue': f'{value}%', 'decimalPlaces':1})
+                if value != devStates.get(key):
+                    if key in ['percent_cpu','percent_mem'] or key.endswith('_value'):
+                        newStates.append({'key':key,'value':value, 'uiValue': f'{value:.1f}%', 'decimalPlaces':1})
                     else:
                         newStates.append({'key':key,'value':value})
 
-            if len(newStates) > 0:
-                if self.plugin.debug: # don't fill up plugin log unless actively debugging
-                    self.logger.debug(f'updating states on device "{self.name}":')
-                    for item in newStates:
-                        self.logger.debug(f'{item["key"].rjust(16):>16}: {value}')
-                self.dev.updateStatesOnServer(newStates)
-                self.states = self.dev.states
+            self.plugin.publisher.submit(self, newStates)
+        return False
+
+    #------------------------------------------------------------------------------
+    def samplePids(self):
+        return None     # totals need every process
 
     #------------------------------------------------------------------------------
     # Class Properties
@@ -461,53 +1111,1366 @@ class SystemLoadDevice(object):
         self.logger.error(f'{["off","on"][newState]} command not supported for "{self.name}"')
     onState = property(onStateGet, onStateSet)
 
+###############################################################################
+class ProcessGroupDevice(SystemLoadDevice):
+
+    #------------------------------------------------------------------------------
+    def update(self, doStats=False):
+        if doStats:
+            stats = self.plugin.groupMatcher.results(self.plugin.psResults).get(self.dev.id, k_emptyGroupStats)
+            self.states['match_count']  = stats['count']
+            self.states['cpu_total']    = stats['cpu_total']/self.plugin.divisor
+            self.states['cpu_max']      = stats['cpu_max']/self.plugin.divisor
+            self.states['mem_total']    = stats['mem_total']
+            self.states['mem_max']      = stats['mem_max']
+            self.states['displayState'] = f"{stats['count']} | {self.states['cpu_total']:.1f}% | {self.states['mem_total']:.1f}%"
+
+            newStates = list()
+            devStates = self.dev.states
+            for key, value in self.states.iteritems():
+                if value != devStates.get(key):
+                    if key in ['cpu_total','cpu_max','mem_total','mem_max']:
+                        newStates.append({'key':key,'value':value, 'uiValue': f'{value:.1f}%', 'decimalPlaces':1})
+                    else:
+                        newStates.append({'key':key,'value':value})
+
+            self.plugin.publisher.submit(self, newStates)
+        return False
+
+###############################################################################
+class HealthDevice(SystemLoadDevice):
+
+    #------------------------------------------------------------------------------
+    def update(self, doStats=False):
+        if doStats:
+            stats = self.plugin.loopStats
+            loop = stats.summary('loop')
+            self.states['loop_p50']     = loop['p50']
+            self.states['loop_p95']     = loop['p95']
+            self.states['loop_max']     = loop['max']
+            self.states['sample_p95']   = stats.summary('sample')['p95']
+            self.states['publish_p95']  = stats.summary('publish')['p95']
+            self.states['overruns']     = stats.counters['overruns']
+            self.states['forks']        = stats.forks
+            self.states['states_pushed']     = stats.pushed
+            self.states['states_suppressed'] = stats.suppressed
+            self.states['displayState'] = f"{loop['p95']:.1f} ms"
+
+            newStates = list()
+            devStates = self.dev.states
+            for key, value in self.states.iteritems():
+                if value != devStates.get(key):
+                    if key in ['loop_p50','loop_p95','loop_max','sample_p95','publish_p95']:
+                        newStates.append({'key':key,'value':value, 'uiValue': f'{value:.1f} ms', 'decimalPlaces':1})
+                    else:
+                        newStates.append({'key':key,'value':value})
+
+            self.plugin.publisher.submit(self, newStates)
+        return False
+
+    #------------------------------------------------------------------------------
+    def samplePids(self):
+        return set()    # reads the plugin's own counters, not processes
+
+###############################################################################
+class GroupMatcher(object):
+    """Matches every process group pattern against a snapshot in one pass.  All
+    patterns are folded into a single regex of optional lookaheads, so one match
+    per process name reports every group it belongs to, and the answer for each
+    name is remembered across snapshots."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self):
+        self.patterns   = dict()    # devId -> (pattern, patternType)
+        self._lock      = threading.Lock()
+        self._compile()
+
+    #------------------------------------------------------------------------------
+    def add(self, devId, pattern, patternType='glob'):
+        with self._lock:
+            self.patterns[devId] = (pattern, patternType)
+            self._compile()
+
+    def remove(self, devId):
+        with self._lock:
+            if self.patterns.pop(devId, None) is not None:
+                self._compile()
+
+    #------------------------------------------------------------------------------
+    def _compile(self):
+        self._names     = dict()    # args -> devIds of matching groups
+        self._results   = (None, dict())
+        self._combined  = None
+        self._separate  = list()
+        # each lookahead matches from the start of the args; regexes may match anywhere
+        lookaheads = dict()
+        separate = list()
+        for devId, (pattern, patternType) in self.patterns.items():
+            if patternType == 'regex' and k_groupRefRegex.search(pattern):
+                separate.append(devId)  # group numbers shift once wrapped in the combined regex
+                continue
+            lookahead = f'(?:(?=(?P<g{devId}>{[fnmatch.translate(pattern), f".*?(?:{pattern})"][patternType == "regex"]})))?'
+            try:
+                re.compile(lookahead)
+                lookaheads[devId] = lookahead
+            except re.error:
+                separate.append(devId)  # e.g. inline flags can't be embedded
+        try:
+            self._combined = re.compile(''.join(lookaheads.values()))
+        except re.error:
+            separate = list(self.patterns)  # e.g. the same group name in two patterns
+            self._combined = None
+        for devId in separate:
+            pattern, patternType = self.patterns[devId]
+            try:
+                rule = re.compile([fnmatch.translate(pattern), pattern][patternType == 'regex'])
+            except re.error:
+                continue    # invalid patterns match nothing
+            self._separate.append((devId, [rule.match, rule.search][patternType == 'regex']))
+
+    #------------------------------------------------------------------------------
+    def groupsFor(self, args):
+        devIds = self._names.get(args)
+        if devIds is None:
+            devIds = tuple(devId for devId, matches in self._separate if matches(args))
+            if self._combined:
+                devIds += tuple(int(name[1:]) for name, value in self._combined.match(args).groupdict().items()
+                                if value is not None and name[:1] == 'g' and name[1:].isdigit())
+            if len(self._names) >= k_groupCacheSize:
+                self._names = dict()
+            self._names[args] = devIds
+        return devIds
+
+    #------------------------------------------------------------------------------
+    def results(self, psTable):
+        # aggregates for every group, worked out once per snapshot
+        with self._lock:
+            if self._results[0] is not psTable:
+                stats = dict((devId, dict(k_emptyGroupStats)) for devId in self.patterns)
+                if self.patterns:
+                    for row in psTable.rows:
+                        for devId in self.groupsFor(row['args']):
+                            group = stats[devId]
+                            group['count']     += 1
+                            group['cpu_total'] += row['pcpu']
+                            group['mem_total'] += row['pmem']
+                            group['cpu_max']    = max(group['cpu_max'], row['pcpu'])
+                            group['mem_max']    = max(group['mem_max'], row['pmem'])
+                self._results = (psTable, stats)
+            return self._results[1]
+
+###############################################################################
+class PollScheduler(object):
+    """Keeps a due time and polling interval for each device.  Intervals back off
+    while a device is stable and drop to the minimum for a short window after a
+    command or state change.  Devices with a fixed interval never back off."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, minInterval, normInterval, maxInterval):
+        self.entries = dict()
+        self._lock = threading.Lock()
+        self.setIntervals(minInterval, normInterval, maxInterval)
+
+    #------------------------------------------------------------------------------
+    def setIntervals(self, minInterval, normInterval, maxInterval):
+        self.minInterval  = float(minInterval)
+        self.normInterval = float(normInterval)
+        self.maxInterval  = float(maxInterval)
+
+    #------------------------------------------------------------------------------
+    def add(self, devId, fixedInterval=None):
+        with self._lock:
+            interval = fixedInterval or self.normInterval
+            self.entries[devId] = { 'interval':  interval,
+                                    'fixed':     fixedInterval,
+                                    'due':       time.time() + interval,
+                                    'fastUntil': 0,
+                                    'lastStats': 0 }
+
+    def remove(self, devId):
+        with self._lock:
+            self.entries.pop(devId, None)
+
+    #------------------------------------------------------------------------------
+    def due(self, now):
+        with self._lock:
+            return [devId for devId, entry in self.entries.items() if entry['due'] <= now]
+
+    def nextDue(self):
+        with self._lock:
+            return min([entry['due'] for entry in self.entries.values()] or [time.time() + self.normInterval])
+
+    def cadence(self, devId):
+        with self._lock:
+            entry = self.entries.get(devId)
+            return dict(entry) if entry else None
+
+    #------------------------------------------------------------------------------
+    def statsDue(self, devId, now, pushStatsFreq):
+        with self._lock:
+            entry = self.entries.get(devId)
+            if not entry:
+                return False
+            if now >= entry['lastStats'] + pushStatsFreq:
+                entry['lastStats'] = now
+                return True
+            return False
+
+    #------------------------------------------------------------------------------
+    def reschedule(self, devId, now, changed=False):
+        with self._lock:
+            entry = self.entries.get(devId)
+            if not entry:
+                return
+            if entry['fixed']:
+                entry['interval'] = entry['fixed']
+            elif changed or now < entry['fastUntil']:
+                if changed:
+                    entry['fastUntil'] = now + k_pollFastWindow
+                entry['interval'] = self.minInterval
+            else:
+                entry['interval'] = min(max(entry['interval']*k_pollBackoff, self.minInterval), self.maxInterval)
+            entry['due'] = now + entry['interval']
+
+    #------------------------------------------------------------------------------
+    def boost(self, devId):
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(devId)
+            if entry and not entry['fixed']:
+                entry['fastUntil'] = now + k_pollFastWindow
+                entry['interval'] = self.minInterval
+                entry['due'] = min(entry['due'], now + self.minInterval)
+
+###############################################################################
+class SampleHistory(object):
+    """Fixed size ring buffer of cpu and memory samples.  Rolling averages for
+    each window in k_historyWindows, peaks and a least squares memory slope over
+    the longest window are all updated incrementally as samples come and go."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, capacity=k_historySize, windows=k_historyWindows):
+        self.capacity   = capacity
+        self.times      = array('d', [0.0]) * capacity
+        self.cpu        = array('d', [0.0]) * capacity
+        self.mem        = array('d', [0.0]) * capacity
+        self.windows    = windows
+        self.keys       = history_state_keys(windows)
+        self.reset()
+
+    #------------------------------------------------------------------------------
+    def reset(self):
+        self.count      = 0     # samples ever added; sample n lives in slot n % capacity
+        self.base       = None  # time origin for the slope sums
+        self.tails      = [0] * len(self.windows)
+        self.cpuSums    = [0.0] * len(self.windows)
+        self.memSums    = [0.0] * len(self.windows)
+        # indexes of decreasing values, so the peak is always at the left
+        self.cpuPeaks   = deque(maxlen=self.capacity)
+        self.memPeaks   = deque(maxlen=self.capacity)
+        self.slopeSums  = [0.0, 0.0, 0.0, 0.0]  # t, m, t*m, t*t over the longest window
+
+    #------------------------------------------------------------------------------
+    def add(self, timestamp, cpu, mem):
+        if self.count and timestamp - self.times[(self.count-1) % self.capacity] < k_historySpacing:
+            return
+        index = self.count
+        # the slot about to be reused must leave every window first
+        for w in range(len(self.windows)):
+            while self.tails[w] <= index - self.capacity:
+                self._evict(w)
+        slot = index % self.capacity
+        self.times[slot], self.cpu[slot], self.mem[slot] = timestamp, cpu, mem
+        self.count += 1
+
+        for w in range(len(self.windows)):
+            self.cpuSums[w] += cpu
+            self.memSums[w] += mem
+        for peaks, values, value in ((self.cpuPeaks, self.cpu, cpu), (self.memPeaks, self.mem, mem)):
+            while peaks and values[peaks[-1] % self.capacity] <= value:
+                peaks.pop()
+            peaks.append(index)
+        if self.base is None:
+            self.base = timestamp
+        self._slope(timestamp, mem, 1)
+
+        for w, (name, span) in enumerate(self.windows):
+            while self.tails[w] < self.count and self.times[self.tails[w] % self.capacity] < timestamp - span:
+                self._evict(w)
+
+    #------------------------------------------------------------------------------
+    def _evict(self, w):
+        slot = self.tails[w] % self.capacity
+        self.cpuSums[w] -= self.cpu[slot]
+        self.memSums[w] -= self.mem[slot]
+        if w == len(self.windows) - 1:
+            for peaks in (self.cpuPeaks, self.memPeaks):
+                if peaks and peaks[0] == self.tails[w]:
+                    peaks.popleft()
+            self._slope(self.times[slot], self.mem[slot], -1)
+        self.tails[w] += 1
+        if self.tails[w] == self.count:
+            # empty window; drop any accumulated rounding error
+            self.cpuSums[w] = self.memSums[w] = 0.0
+            if w == len(self.windows) - 1:
+                self.slopeSums = [0.0, 0.0, 0.0, 0.0]
+
+    #------------------------------------------------------------------------------
+    def _slope(self, timestamp, mem, sign):
+        hours = (timestamp - self.base) / 3600.0
+        sums = self.slopeSums
+        sums[0] += sign * hours
+        sums[1] += sign * mem
+        sums[2] += sign * hours * mem
+        sums[3] += sign * hours * hours
+
+    #------------------------------------------------------------------------------
+    def states(self):
+        states = dict()
+        for w, (name, span) in enumerate(self.windows):
+            n = self.count - self.tails[w]
+            states[f'cpu_avg_{name}'] = round(self.cpuSums[w] / n, 2) if n else 0.0
+            states[f'mem_avg_{name}'] = round(self.memSums[w] / n, 2) if n else 0.0
+        name = self.windows[-1][0]
+        states[f'cpu_peak_{name}'] = self.cpu[self.cpuPeaks[0] % self.capacity] if self.cpuPeaks else 0.0
+        states[f'mem_peak_{name}'] = self.mem[self.memPeaks[0] % self.capacity] if self.memPeaks else 0.0
+        n = self.count - self.tails[-1]
+        st, sm, stm, stt = self.slopeSums
+        denominator = n * stt - st * st
+        states['mem_slope'] = round((n * stm - st * sm) / denominator, 3) if n > 1 and denominator > 1e-12 else 0.0
+        return states
+
+###############################################################################
+class StatePublisher(object):
+    """Batches state updates from one loop into a single updateStatesOnServer call
+    per device, dropping changes that are inside a state's deadband or that come
+    sooner than the minimum republish interval.  On/off and process status
+    changes are published at once, along with anything already queued."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        self.plugin     = plugin
+        self.logger     = plugin.logger
+        self.deadbands  = dict()
+        self.minInterval = 0
+        self.published  = 0
+        self.suppressed = 0
+        self._queue     = dict()
+        self._lastPush  = dict()
+        self._lock      = threading.Lock()
+
+    #------------------------------------------------------------------------------
+    def configure(self, prefs):
+        cpuDeadband = float(prefs.get('cpuDeadband','1.0'))
+        memDeadband = float(prefs.get('memDeadband','0.2'))
+        self.deadbands = {  'percent_cpu':  cpuDeadband,
+                            'percent_mem':  memDeadband,
+                            'elapsed_secs': int(prefs.get('elapsedGranularity','60')) }
+        for key in history_state_keys() + ['mem_slope','cpu_total','cpu_max','mem_total','mem_max','tree_cpu','tree_mem']:
+            self.deadbands[key] = [memDeadband, cpuDeadband]['cpu' in key]
+        self.minInterval = int(prefs.get('minRepublishFreq','0'))
+
+    #------------------------------------------------------------------------------
+    def submit(self, device, newStates):
+        # returns True if an urgent state was among the changes
+        urgent = any(item['key'] in k_urgentStates for item in newStates)
+        with self._lock:
+            if newStates:
+                queued = self._queue.setdefault(device.dev.id, (device, dict()))[1]
+                for item in newStates:
+                    queued[item['key']] = item
+            if urgent:
+                device, queued = self._queue.pop(device.dev.id)
+                self._publish(device, list(queued.values()))
+        return urgent
+
+    #------------------------------------------------------------------------------
+    def flush(self):
+        with self._lock:
+            now = time.time()
+            for devId, (device, queued) in self._queue.items():
+                devStates = device.dev.states
+                accepted = dict()
+                for key, item in queued.items():
+                    if key in k_followerStates:
+                        continue
+                    if key in self.deadbands and key in devStates and abs(item['value'] - devStates[key]) < self.deadbands[key]:
+                        continue
+                    if now < self._lastPush.get((devId,key), 0) + self.minInterval:
+                        continue
+                    accepted[key] = item
+                for key, item in queued.items():
+                    if key in k_followerStates and any(parent in accepted for parent in k_followerStates[key]):
+                        accepted[key] = item
+                self.suppressed += len(queued) - len(accepted)
+                if accepted:
+                    self._publish(device, list(accepted.values()), now)
+            self._queue = dict()
+
+    #------------------------------------------------------------------------------
+    def discard(self, devId):
+        with self._lock:
+            self._queue.pop(devId, None)
+            for key in [key for key in self._lastPush if key[0] == devId]:
+                del self._lastPush[key]
+
+    #------------------------------------------------------------------------------
+    def _publish(self, device, newStates, now=None):
+        now = now or time.time()
+        if self.plugin.debug: # don't fill up plugin log unless actively debugging
+            self.logger.debug(f'updating states on device "{device.name}":')
+            for item in newStates:
+                self.logger.debug(f'{item["key"]:>16}: {item["value"]}')
+        start = self.plugin.loopStats.start()
+        device.dev.updateStatesOnServer(newStates)
+        self.plugin.loopStats.record('publish', start)
+        for item in newStates:
+            self._lastPush[(device.dev.id,item['key'])] = now
+        self.published += len(newStates)
+
+###############################################################################
+class LoopStats(object):
+    """Rolling timings for each phase of the polling loop (see k_loopPhases) and
+    event counters.  Only the last k_loopStatsSize timings of each phase are
+    kept, and percentiles are only worked out when asked for."""
+
+    enabled = True
+
+    #------------------------------------------------------------------------------
+    def __init__(self, publisher, size=k_loopStatsSize):
+        self.publisher  = publisher
+        self.timings    = {phase: deque(maxlen=size) for phase in k_loopPhases}
+        self.counters   = {'overruns': 0}
+        self.since      = time.time()
+        self._forks     = shell_forks
+        self._published = publisher.published
+        self._suppressed = publisher.suppressed
+
+    #------------------------------------------------------------------------------
+    def start(self):
+        return time.perf_counter()
+
+    #------------------------------------------------------------------------------
+    def record(self, phase, start=None, elapsed=None):
+        if elapsed is None:
+            elapsed = time.perf_counter() - start
+        self.timings[phase].append(elapsed)
+
+    #------------------------------------------------------------------------------
+    def count(self, counter, n=1):
+        self.counters[counter] = self.counters.get(counter, 0) + n
+
+    #------------------------------------------------------------------------------
+    @property
+    def forks(self):
+        return shell_forks - self._forks
+
+    #------------------------------------------------------------------------------
+    @property
+    def pushed(self):
+        return self.publisher.published - self._published
+
+    #------------------------------------------------------------------------------
+    @property
+    def suppressed(self):
+        return self.publisher.suppressed - self._suppressed
+
+    #------------------------------------------------------------------------------
+    def summary(self, phase):
+        # count and p50/p95/max in milliseconds
+        values = sorted(self.timings[phase])
+        if not values:
+            return {'count':0, 'p50':0.0, 'p95':0.0, 'max':0.0}
+        return {'count': len(values),
+                'p50':   round(values[int(0.50*(len(values)-1))]*1000, 1),
+                'p95':   round(values[int(0.95*(len(values)-1))]*1000, 1),
+                'max':   round(values[-1]*1000, 1) }
+
+    #------------------------------------------------------------------------------
+    def report(self):
+        lines = list()
+        for phase in k_loopPhases:
+            summary = self.summary(phase)
+            lines.append(f'{phase:>16}: p50 {summary["p50"]:.1f} ms, p95 {summary["p95"]:.1f} ms, max {summary["max"]:.1f} ms ({summary["count"]} timings)')
+        lines.append(f'{"forks":>16}: {self.forks}')
+        for counter, value in self.counters.items():
+            lines.append(f'{counter:>16}: {value}')
+        lines.append(f'{"states pushed":>16}: {self.pushed}')
+        lines.append(f'{"suppressed":>16}: {self.suppressed}')
+        lines.append(f'{"since":>16}: {datetime.fromtimestamp(self.since):%Y-%m-%d %H:%M:%S}')
+        return lines
+
+###############################################################################
+class NullLoopStats(object):
+    """Stands in for LoopStats when instrumentation is off; every call is a no-op."""
+
+    enabled     = False
+    counters    = {'overruns': 0}
+    forks       = 0
+    pushed      = 0
+    suppressed  = 0
+
+    def start(self):
+        return 0
+    def record(self, phase, start=None, elapsed=None):
+        pass
+    def count(self, counter, n=1):
+        pass
+    def summary(self, phase):
+        return {'count':0, 'p50':0.0, 'p95':0.0, 'max':0.0}
+    def report(self):
+        return []
+
+###############################################################################
+class TriggerMonitor(object):
+    """Plugin events, checked against each sample a device takes rather than its
+    published states.  Each device keeps its own triggers, so a sample only costs
+    a constant amount of work per trigger on that device.  Threshold events fire
+    once when the value has been over the threshold for the whole duration, and
+    re-arm when it falls to the threshold minus the hysteresis."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self):
+        self.byDevice   = dict()
+        self._lock      = threading.Lock()
+
+    #------------------------------------------------------------------------------
+    def add(self, trigger):
+        props = trigger.pluginProps
+        threshold = float(props.get('threshold','0') or 0)
+        watcher = { 'trigger':      trigger,
+                    'type':         trigger.pluginTypeId,
+                    'threshold':    threshold,
+                    'clear':        threshold - float(props.get('hysteresis','0') or 0),
+                    'duration':     float(props.get('duration','0') or 0),
+                    'unexpected':   props.get('unexpectedOnly', True),
+                    'armed':        True,
+                    'since':        None }
+        with self._lock:
+            self.byDevice.setdefault(int(props.get('deviceId') or 0), dict())[trigger.id] = watcher
+
+    #------------------------------------------------------------------------------
+    def remove(self, trigger):
+        with self._lock:
+            for watchers in self.byDevice.values():
+                watchers.pop(trigger.id, None)
+
+    #------------------------------------------------------------------------------
+    def evaluate(self, devId, timestamp, started, exited, expected, cpu, mem):
+        watchers = self.byDevice.get(devId)
+        if not watchers:
+            return
+        fire = list()
+        with self._lock:
+            for watcher in watchers.values():
+                if watcher['type'] == 'processStarted':
+                    if started:
+                        fire.append(watcher['trigger'])
+                elif watcher['type'] == 'processExited':
+                    if exited and not (expected and watcher['unexpected']):
+                        fire.append(watcher['trigger'])
+                else:
+                    value = [mem, cpu][watcher['type'] == 'cpuAbove']
+                    if value > watcher['threshold']:
+                        if watcher['since'] is None:
+                            watcher['since'] = timestamp
+                        if watcher['armed'] and timestamp - watcher['since'] >= watcher['duration']:
+                            watcher['armed'] = False
+                            fire.append(watcher['trigger'])
+                    else:
+                        # the duration counts from the latest crossing; only re-arming waits for the hysteresis
+                        watcher['since'] = None
+                        if value <= watcher['clear']:
+                            watcher['armed'] = True
+        for trigger in fire:
+            indigo.trigger.execute(trigger)
+
+###############################################################################
+class MetricsExporter(object):
+    """Serves device stats in the Prometheus text format, either on a loopback
+    HTTP port or as a file that is replaced atomically.  The text is rendered
+    once for each new snapshot and scrapes only ever read the cached copy, so
+    they never cause a sample."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, mode, target, logger):
+        self.mode       = mode
+        self.target     = target
+        self.logger     = logger
+        self.generation = None
+        self.body       = b''
+        self._server    = None
+        self._thread    = None
+
+    #------------------------------------------------------------------------------
+    def start(self):
+        if self.mode == 'http':
+            exporter = self
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path not in ('/','/metrics'):
+                        self.send_error(404)
+                        return
+                    body = exporter.body
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                def log_message(self, format, *args):
+                    pass
+            self._server = ThreadingHTTPServer((k_exportHost, int(self.target)), Handler)
+            self._server.daemon_threads = True
+            self._thread = threading.Thread(target=self._server.serve_forever, name='MetricsExporter', daemon=True)
+            self._thread.start()
+            self.logger.debug(f'serving metrics on http://{k_exportHost}:{self.target}/metrics')
+        elif not self.target.strip() or os.path.isdir(os.path.expanduser(self.target)):
+            # prefs saved before the path was validated
+            raise ValueError(f'"{self.target}" is not a file path')
+
+    #------------------------------------------------------------------------------
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    #------------------------------------------------------------------------------
+    def update(self, psTable, deviceDict):
+        # re-render only when there is a new snapshot
+        if psTable.generation == self.generation and self.body:
+            return
+        self.generation = psTable.generation
+        self.body = self.render(psTable, deviceDict).encode('utf-8')
+        if self.mode == 'file':
+            path = os.path.expanduser(self.target)
+            try:
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(self.body)
+                os.replace(path + '.tmp', path)
+            except (IOError, OSError) as e:
+                self.logger.error(f'unable to write metrics file "{path}": {e}')
+
+    #------------------------------------------------------------------------------
+    def render(self, psTable, deviceDict):
+        devices = sorted(deviceDict.items())
+        lines = list()
+        for metric, text, types, key in k_exportMetrics:
+            samples = list()
+            for devId, device in devices:
+                if device.type in types and key in device.states:
+                    value = device.states[key]
+                    samples.append(f'{metric}{{device="{prometheus_escape(device.name)}",type="{device.type}"}} {float(value or 0):g}')
+            if samples:
+                lines += [f'# HELP {metric} {text}', f'# TYPE {metric} gauge'] + samples
+        lines += [  '# HELP macapps_snapshot_timestamp_seconds When the process snapshot was taken',
+                    '# TYPE macapps_snapshot_timestamp_seconds gauge',
+                    f'macapps_snapshot_timestamp_seconds {psTable.timestamp:.3f}',
+                    '# HELP macapps_snapshot_processes Processes in the last full snapshot',
+                    '# TYPE macapps_snapshot_processes gauge',
+                    f'macapps_snapshot_processes {len(psTable.identities)}',    # targeted tables carry these over
+                    '# HELP macapps_snapshot_generation Snapshots taken since the plugin started',
+                    '# TYPE macapps_snapshot_generation counter',
+                    f'macapps_snapshot_generation {psTable.generation}' ]
+        return '\n'.join(lines) + '\n'
+
+###############################################################################
+class StartTimeCache(object):
+    """Process start times parsed from the ps lstart text, once per pid.  Entries
+    are dropped when a full snapshot shows the pid has exited."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self):
+        self.entries = dict()
+
+    #------------------------------------------------------------------------------
+    def get(self, pid, lstart):
+        entry = self.entries.get(pid)
+        if entry is None or entry[0] != lstart:
+            # new pid, or a reused one
+            entry = (lstart, lstart_to_timestamp(lstart))
+            self.entries[pid] = entry
+        return entry[1]
+
+    #------------------------------------------------------------------------------
+    def evict(self, pids):
+        for pid in pids:
+            self.entries.pop(pid, None)
+
+###############################################################################
+class CommandWatcher(object):
+    """Confirms sent commands for every pending device on one thread, polling
+    shared snapshots until each process appears or goes away, or times out.
+    Command pool workers are free again as soon as their command returns."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, plugin):
+        self.plugin     = plugin
+        self.logger     = plugin.logger
+        self.pending    = dict()    # devId -> (device, newState, timeout, deadline)
+        self._cond      = threading.Condition()
+        self._interval  = k_confirmPollMin
+        self._thread    = None
+        self._running   = False
+
+    #------------------------------------------------------------------------------
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='CommandWatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    #------------------------------------------------------------------------------
+    def add(self, device, newState, timeout):
+        with self._cond:
+            self.pending[device.dev.id] = (device, newState, timeout, time.time() + timeout)
+            self._interval = k_confirmPollMin  # a new command polls fast again
+            self._cond.notify()
+
+    def discard(self, devId):
+        with self._cond:
+            self.pending.pop(devId, None)
+
+    #------------------------------------------------------------------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self.pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                waiting = list(self.pending.values())
+            self.plugin.snapshot(0)
+            now = time.time()
+            for device, newState, timeout, deadline in waiting:
+                try:
+                    device.update(True)
+                    if device.onState != newState:
+                        if now < deadline:
+                            continue
+                        self.logger.error(f'{device.type} "{device.props["applicationName"]}" did not {["quit","launch"][newState]} within {timeout} seconds')
+                except Exception:
+                    self.logger.exception(f'error confirming command for "{device.name}"')
+                with self._cond:
+                    self.pending.pop(device.dev.id, None)
+                device.endCommand()
+            with self._cond:
+                if self._running and self.pending:
+                    interval = self._interval
+                    self._interval = min(interval*2, k_confirmPollMax)
+                    self._cond.wait(interval)
+
+###############################################################################
+class ExitWatcher(object):
+    """Waits for OS exit notifications on the processes devices are bound to, all
+    on one thread, and calls callback(devId, pid) as soon as one exits."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, callback, logger):
+        self.callback   = callback
+        self.logger     = logger
+        self.watched    = dict()    # devId -> pid
+        self._changes   = list()
+        self._lock      = threading.Lock()
+        self._thread    = None
+        self._running   = False
+
+    #------------------------------------------------------------------------------
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='ExitWatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    #------------------------------------------------------------------------------
+    def watch(self, devId, pid):
+        with self._lock:
+            if self.watched.get(devId) != pid:
+                self.watched[devId] = pid
+                self._changes.append((devId, pid))
+
+    def unwatch(self, devId):
+        with self._lock:
+            if self.watched.pop(devId, None) is not None:
+                self._changes.append((devId, None))
+
+    #------------------------------------------------------------------------------
+    def _run(self):
+        handles = dict()    # devId -> (pid, handle)
+        try:
+            while self._running:
+                with self._lock:
+                    changes, self._changes = self._changes, list()
+                for devId, pid in changes:
+                    if devId in handles:
+                        self._close(devId, *handles.pop(devId))
+                    if pid:
+                        try:
+                            handles[devId] = (pid, self._open(devId, pid))
+                        except ProcessLookupError:
+                            self._exited(devId, pid)
+                        except OSError as e:
+                            self.logger.debug(f'unable to watch pid {pid}: {e}')
+                for devId in self._wait(k_exitWatchTimeout):
+                    if devId in handles:
+                        pid, handle = handles.pop(devId)
+                        self._close(devId, pid, handle)
+                        self._exited(devId, pid)
+        finally:
+            for devId, (pid, handle) in handles.items():
+                self._close(devId, pid, handle)
+            self._shutdown()
+
+    #------------------------------------------------------------------------------
+    def _exited(self, devId, pid):
+        with self._lock:
+            if self.watched.get(devId) == pid:
+                del self.watched[devId]
+            else:
+                return  # no longer interested in this pid
+        try:
+            self.callback(devId, pid)
+        except Exception:
+            self.logger.exception(f'error handling exit of pid {pid}')
+
+###############################################################################
+class KqueueExitWatcher(ExitWatcher):
+    """macOS and BSD: kqueue EVFILT_PROC / NOTE_EXIT."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, callback, logger):
+        super(KqueueExitWatcher, self).__init__(callback, logger)
+        self.kq = select.kqueue()
+        self._devIds = dict()   # pid -> set of devIds; one registration per pid, however many devices
+
+    def _open(self, devId, pid):
+        if int(pid) not in self._devIds:
+            self.kq.control([select.kevent(int(pid), filter=select.KQ_FILTER_PROC,
+                            flags=select.KQ_EV_ADD|select.KQ_EV_ONESHOT, fflags=select.KQ_NOTE_EXIT)], 0)
+            self._devIds[int(pid)] = set()
+        self._devIds[int(pid)].add(devId)
+        return int(pid)
+
+    def _close(self, devId, pid, handle):
+        devIds = self._devIds.get(handle)
+        if devIds is not None and devId in devIds:
+            devIds.discard(devId)
+            if not devIds:
+                del self._devIds[handle]
+                try:
+                    self.kq.control([select.kevent(handle, filter=select.KQ_FILTER_PROC, flags=select.KQ_EV_DELETE)], 0)
+                except OSError:
+                    pass    # already gone
+
+    def _wait(self, timeout):
+        return [devId for event in self.kq.control(None, 64, timeout) for devId in list(self._devIds.get(event.ident, ()))]
+
+    def _shutdown(self):
+        self.kq.close()
+
+###############################################################################
+class PidfdExitWatcher(ExitWatcher):
+    """Linux: a pidfd per process, which becomes readable when it exits."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, callback, logger):
+        super(PidfdExitWatcher, self).__init__(callback, logger)
+        self.selector = selectors.DefaultSelector()
+
+    def _open(self, devId, pid):
+        fd = os.pidfd_open(int(pid))
+        self.selector.register(fd, selectors.EVENT_READ, devId)
+        return fd
+
+    def _close(self, devId, pid, handle):
+        self.selector.unregister(handle)
+        os.close(handle)
+
+    def _wait(self, timeout):
+        if not self.selector.get_map():
+            time.sleep(timeout)
+            return []
+        return [key.data for key, mask in self.selector.select(timeout)]
+
+    def _shutdown(self):
+        self.selector.close()
+
+###############################################################################
+class ProcessSampler(object):
+    """Sampling backend interface.  sample() returns (success, records) where each
+    record is a dict keyed by k_psInfoGroupsKeys, with pcpu and pmem as floats."""
+
+    name = None
+
+    #------------------------------------------------------------------------------
+    def sample(self, pids=None, stats=None):
+        # pids limits the sample to those processes, None samples everything
+        stats = stats or NullLoopStats()
+        start = stats.start()
+        success, data = self.collect(pids)
+        stats.record('sample', start)
+        if success:
+            start = stats.start()
+            records = self.parse(data)
+            stats.record('parse', start)
+            return True, records
+        return False, []
+
+    #------------------------------------------------------------------------------
+    def collect(self, pids=None):
+        raise NotImplementedError
+
+    #------------------------------------------------------------------------------
+    def parse(self, data):
+        raise NotImplementedError
+
+###############################################################################
+class PsSampler(ProcessSampler):
+    """Runs the ps command and parses its text output."""
+
+    name = 'ps'
+
+    #------------------------------------------------------------------------------
+    def collect(self, pids=None):
+        if pids:
+            # ps exits non-zero when some of the pids are gone, so keep whatever it found
+            success, data = do_shell_script(k_psGetPidsCmd(pids=','.join(sorted(pids))))
+            return True, data.decode('utf-8')
+        success, data = do_shell_script(k_psGetDataCmd)
+        return success, data.decode('utf-8')
+
+    #------------------------------------------------------------------------------
+    def parse(self, psData):
+        records = list()
+        for line in psData.splitlines():
+            row = parse_ps_row(line)
+            if not row:
+                # keep unparsed rows in the totals, as summing the columns did
+                pcpu, pmem = column_floats(line)
+                if not (pcpu or pmem):
+                    continue
+                row = dict.fromkeys(k_psInfoGroupsKeys)
+                row['pcpu'], row['pmem'] = pcpu, pmem
+            records.append(row)
+        return records
+
+###############################################################################
+class ProcSampler(ProcessSampler):
+    """Reads /proc directly, without forking.  CPU percent is the share of one
+    core used since the previous sample (or since process start on the first)."""
+
+    name = 'proc'
+
+    #------------------------------------------------------------------------------
+    def __init__(self, procPath=k_procPath):
+        self.procPath   = procPath
+        self.clockTicks = float(os.sysconf('SC_CLK_TCK'))
+        self.pageSize   = os.sysconf('SC_PAGE_SIZE')
+        self.bootTime   = None
+        self.memTotal   = None
+        self._cpuTimes  = dict()
+
+    #------------------------------------------------------------------------------
+    def collect(self, pids=None):
+        try:
+            if self.bootTime is None:
+                self.bootTime = proc_boot_time(self.procPath)
+                self.memTotal = proc_mem_total(self.procPath)
+            uptime = proc_uptime(self.procPath)
+            partial = bool(pids)
+            if not partial:
+                pids = [name for name in os.listdir(self.procPath) if name.isdigit()]
+        except (IOError, OSError, ValueError):
+            return False, None
+        raw = list()
+        for pid in pids:
+            try:
+                stat = read_file(f'{self.procPath}/{pid}/stat')
+            except (IOError, OSError):
+                continue    # exited while we were reading
+            raw.append((pid, stat))
+        return True, (uptime, raw, partial)
+
+    #------------------------------------------------------------------------------
+    def parse(self, data):
+        uptime, raw, partial = data
+        # cpu times are kept per pid, so targeted samples don't lose the others
+        cpuTimes = dict(self._cpuTimes) if partial else dict()
+        records  = list()
+        for pid, stat in raw:
+            # comm is in parens and may itself contain spaces or parens
+            close = stat.rfind(')')
+            comm = stat[stat.find('(')+1:close]
+            fields = stat[close+2:].split()
+            state = k_procStateMap.get(fields[0], 'S')
+            if state is None:
+                continue
+            jiffies = int(fields[11]) + int(fields[12])
+            startTicks = int(fields[19])
+            cpuTimes[pid] = (startTicks, jiffies, uptime)
+
+            elapsed = max(uptime - startTicks/self.clockTicks, 0.0)
+            previous = self._cpuTimes.get(pid)
+            if previous and previous[0] == startTicks and uptime > previous[2]:
+                pcpu = (jiffies - previous[1]) / self.clockTicks / (uptime - previous[2]) * 100.0
+            elif elapsed > 0:
+                pcpu = jiffies / self.clockTicks / elapsed * 100.0
+            else:
+                pcpu = 0.0
+
+            records.append({
+                'pid':      pid,
+                'ppid':     fields[1],
+                'state':    state,
+                'pcpu':     round(pcpu, 1),
+                'pmem':     round(int(fields[21]) * self.pageSize * 100.0 / self.memTotal, 1),
+                'lstart':   timestamp_to_lstart(self.bootTime + startTicks/self.clockTicks),
+                'etime':    seconds_to_etime(elapsed),
+                'args':     comm,  # what ps -c prints, so both backends match the same names
+                })
+        self._cpuTimes = cpuTimes
+        return records
+
+###############################################################################
+class ProcessTable(object):
+    """Process records from one sample, indexed by pid and process name.  Each
+    table is a snapshot with a generation number and capture timestamp, and is
+    not modified after it is published (the name indexes are only caches)."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, records, previous=None, partial=False, timestamp=0, topCount=0):
+        self.timestamp  = timestamp
+        self.partial    = partial
+        self.topCount   = topCount
+        self.rows       = list()
+        self.byPid      = dict()
+        self.byArgs     = dict()
+        self.totalCpu   = 0.0
+        self.totalMem   = 0.0
+        # bounded min-heaps of the largest consumers, kept during the same pass
+        heaps = {rowKey: list() for prefix, rowKey, label in k_topRankings} if topCount else dict()
+        for row in records:
+            self.totalCpu += row['pcpu']
+            self.totalMem += row['pmem']
+            if row['pid'] is None:
+                continue    # counts toward the totals only
+            self.byPid.setdefault(row['pid'], row)
+            self.byArgs.setdefault(row['args'], len(self.rows))
+            for rowKey, heap in heaps.items():
+                entry = (row[rowKey], len(self.rows))
+                if len(heap) < topCount:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+            self.rows.append(row)
+        self.top = {rowKey: [self.rows[index] for value, index in sorted(heaps.get(rowKey, ()), reverse=True)]
+                    for prefix, rowKey, label in k_topRankings}
+
+        # diff against the previous snapshot; a pid with a new start time is a new process
+        self.identities = frozenset((pid, row['lstart']) for pid, row in self.byPid.items())
+        if previous is None:
+            self.generation = 0
+            started = self.identities
+            exited = frozenset()
+        elif partial:
+            # a targeted sample is only kept when every pid it asked for was still
+            # there, so the rest of the previous process set carries over unchanged
+            self.generation = previous.generation + 1
+            self.identities = previous.identities
+            started = exited = frozenset()
+        else:
+            self.generation = previous.generation + 1
+            started = self.identities - previous.identities
+            exited = previous.identities - self.identities
+        self.started    = frozenset(pid for pid, lstart in started)
+        self.exited     = frozenset(pid for pid, lstart in exited)
+
+        self._byAppName = None
+        self._byHelper  = None
+        self._startedTable = None
+
+        # the child index is patched from the last full table that built one
+        self._children  = None
+        self._baseIndex = None
+        if previous is not None:
+            self._baseIndex = previous._baseIndex if previous.partial else previous._children
+            if self._baseIndex is not None and self._baseIndex[2] is not previous.identities:
+                self._baseIndex = None
+
+    #------------------------------------------------------------------------------
+    def covers(self, pids=None):
+        # whether this table can answer for these pids (None means every process)
+        return not self.partial or (pids is not None and self.byPid.keys() >= pids)
+
+    #------------------------------------------------------------------------------
+    @property
+    def startedTable(self):
+        # only the processes that are new since the previous snapshot
+        if self._startedTable is None:
+            self._startedTable = ProcessTable([row for row in self.rows if row['pid'] in self.started])
+        return self._startedTable
+
+    #------------------------------------------------------------------------------
+    @property
+    def children(self):
+        # ppid -> set of child pids, patched from the previous index when few processes changed
+        if self._children is None:
+            base = self._baseIndex
+            if self.partial or base is None or len(self.started) + len(self.exited) > k_childIndexChurn * len(self.rows):
+                parents, children = dict(), dict()
+                for row in self.rows:
+                    parents[row['pid']] = row['ppid']
+                    children.setdefault(row['ppid'], set()).add(row['pid'])
+            else:
+                parents, children = dict(base[0]), dict(base[1])
+                for pid in self.exited:
+                    ppid = parents.pop(pid, None)
+                    if ppid in children:
+                        children[ppid] = children[ppid] - {pid}
+                    # orphans are reparented, so look their new parent up
+                    for child in children.pop(pid, ()):
+                        row = self.byPid.get(child)
+                        if row and parents.get(child) == pid:
+                            parents[child] = row['ppid']
+                            children[row['ppid']] = children.get(row['ppid'], set()) | {child}
+                for pid in self.started:
+                    ppid = self.byPid[pid]['ppid']
+                    parents[pid] = ppid
+                    children[ppid] = children.get(ppid, set()) | {pid}
+            if not self.partial:
+                self._baseIndex = None
+            self._children = (parents, children, self.identities)
+        return self._children[1]
+
+    #------------------------------------------------------------------------------
+    def treeTotals(self, pid):
+        # cpu, mem and descendant count for a process and everything under it
+        children = self.children
+        cpu = mem = 0.0
+        count = -1
+        stack, seen = [pid], set()
+        while stack:
+            pid = stack.pop()
+            row = self.byPid.get(pid)
+            if pid in seen or not row:
+                continue
+            seen.add(pid)
+            cpu += row['pcpu']
+            mem += row['pmem']
+            count += 1
+            stack.extend(children.get(pid, ()))
+        return cpu, mem, max(count, 0)
+
+    #------------------------------------------------------------------------------
+    def findPid(self, pid):
+        return self.byPid.get(pid)
+
+    #------------------------------------------------------------------------------
+    def findAppName(self, processname):
+        if self._byAppName is None:
+            self._byAppName = dict()
+            for index, row in enumerate(self.rows):
+                self._byAppName.setdefault(k_psnSuffixRegex.sub('', row['args']), index)
+        row = self._row(self._byAppName.get(processname))
+        if row is None and has_regex_chars(processname):
+            # names containing regex syntax keep their original pattern semantics
+            return self.searchArgs(k_psSearch_appname(processname=processname))
+        return row
+
+    #------------------------------------------------------------------------------
+    def findHelper(self, processname):
+        if self._byHelper is None:
+            self._byHelper = dict()
+            for index, row in enumerate(self.rows):
+                for key in helper_keys(row['args']):
+                    self._byHelper.setdefault(key, index)
+        row = self._row(self._byHelper.get(processname))
+        if row is None and has_regex_chars(processname):
+            return self.searchArgs(k_psSearch_helper(processname=processname))
+        return row
+
+    #------------------------------------------------------------------------------
+    def findDaemon(self, processname, args):
+        indexes = [index for index in (self.byArgs.get(processname+args), self.byArgs.get(processname+' '+args)) if index is not None]
+        row = self._row(min(indexes) if indexes else None)
+        if row is None and (has_regex_chars(processname) or has_regex_chars(args)):
+            return self.searchArgs(k_psSearch_daemon(processname=processname, args=args))
+        return row
+
+    #------------------------------------------------------------------------------
+    def searchArgs(self, pattern):
+        rule = re.compile(pattern+'$')
+        for row in self.rows:
+            if rule.match(row['args']):
+                return row
+        return None
+
+    #------------------------------------------------------------------------------
+    def _row(self, index):
+        return None if index is None else self.rows[index]
+
 ###############################################################################
 # Utilities
 ###############################################################################
-def do_shell_script(cmd):
+def do_shell_script(cmd, timeout=None):
+    global shell_forks
+    shell_forks += 1
     p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    out, err = p.communicate()
+    try:
+        out, err = p.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        p.kill()
+        out, err = p.communicate()
+        return False, f'timed out after {timeout} seconds'.encode('utf-8')
     return (not bool(p.returncode)), out.rstrip()
 
 #------------------------------------------------------------------------------
 def re_extract(source, rule, keys):
+    match = rule.match(source)
+    if not match:
+        return None
     results = dict()
-    for key, value in zip(keys,rule.match(source).groups()):
+    for key, value in zip(keys,match.groups()):
         results[key] = value.strip()
     return results
 
+#------------------------------------------------------------------------------
+def parse_ps_row(line):
+    row = re_extract(line, k_psInfoGroupsRegex, k_psInfoGroupsKeys)
+    if row:
+        row['pcpu'] = float(row['pcpu'].replace(',','.'))
+        row['pmem'] = float(row['pmem'].replace(',','.'))
+    return row
+
+#------------------------------------------------------------------------------
+def column_floats(line):
+    try:
+        fields = line.split(None, 5)
+        return float(fields[3].replace(',','.')), float(fields[4].replace(',','.'))
+    except (IndexError, ValueError):
+        return 0.0, 0.0
+
+#------------------------------------------------------------------------------
+def has_regex_chars(text):
+    return not k_regexMetaChars.isdisjoint(text)
+
+#------------------------------------------------------------------------------
+def helper_keys(args):
+    # every process name that k_psSearch_helper would accept for these args
+    keys = {args}
+    index = args.find(' -', 1)
+    while index > 0:
+        keys.add(args[:index])
+        if args[index-1] == ' ':
+            keys.add(args[:index-1])
+        index = args.find(' -', index+1)
+    return keys
+
+#------------------------------------------------------------------------------
+def seconds_to_etime(seconds):
+    # same layout as the ps etime column: [[dd-]hh:]mm:ss
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f'{days}-{hours:02d}:{minutes:02d}:{seconds:02d}'
+    elif hours:
+        return f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes:02d}:{seconds:02d}'
+
 #------------------------------------------------------------------------------
 def etime_to_seconds(etime):
+    days, dash, clock = etime.rpartition('-')
+    seconds = 0
+    for part in clock.split(':'):
+        seconds = seconds*60 + int(part)
+    return int(days or 0)*86400 + seconds
+
+#------------------------------------------------------------------------------
+def lstart_to_timestamp(lstart):
+    # epoch seconds, or None if the text can't be parsed
     try:
-        days, etime = etime.split('-')
-    except:
-        days = 0
+        weekday, month, day, clock, year = lstart.split()
+        hours, minutes, seconds = clock.split(':')
+        return time.mktime((int(year), k_lstartMonthNums[month], int(day), int(hours), int(minutes), int(seconds), 0, 0, -1))
+    except (ValueError, KeyError):
+        pass
     try:
-        (hours,minutes,seconds) = etime.split(':')
-    except:
-        hours = 0
-        (minutes,seconds) = etime.split(':')
-    return ((int(days)*24 + int(hours))*60 + int(minutes))*60 + int(seconds)
+        return time.mktime(time.strptime(lstart, '%c'))   # ps running in another locale
+    except ValueError:
+        return None
 
 #------------------------------------------------------------------------------
-def lstart_to_timestamp(lstart):
-    return str(datetime.strptime(lstart, '%c'))
+def timestamp_to_lstart(timestamp):
+    # the ps lstart layout, without depending on the locale
+    t = time.localtime(timestamp)
+    return f'{k_lstartDays[t.tm_wday]} {k_lstartMonths[t.tm_mon-1]} {t.tm_mday:2d} {t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d} {t.tm_year}'
+
+#------------------------------------------------------------------------------
+def prometheus_escape(text):
+    return text.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+#------------------------------------------------------------------------------
+def make_sampler(backend):
+    if backend == 'proc':
+        return ProcSampler()
+    return PsSampler()
+
+#------------------------------------------------------------------------------
+def history_state_keys(windows=k_historyWindows):
+    # percent states filled from SampleHistory (mem_slope is separate)
+    keys = [f'{kind}_avg_{name}' for kind in ('cpu','mem') for name, span in windows]
+    return keys + [f'cpu_peak_{windows[-1][0]}', f'mem_peak_{windows[-1][0]}']
+
+#------------------------------------------------------------------------------
+def make_exit_watcher(callback, logger):
+    # None when the OS has no process exit notifications; devices are then polled only
+    if hasattr(select, 'kqueue') and hasattr(select, 'KQ_FILTER_PROC'):
+        return KqueueExitWatcher(callback, logger)
+    if hasattr(os, 'pidfd_open'):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+            return PidfdExitWatcher(callback, logger)
+        except OSError:
+            pass
+    return None
+
+#------------------------------------------------------------------------------
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('utf-8', 'replace')
+
+#------------------------------------------------------------------------------
+def proc_uptime(procPath):
+    return float(read_file(f'{procPath}/uptime').split()[0])
+
+#------------------------------------------------------------------------------
+def proc_boot_time(procPath):
+    for line in read_file(f'{procPath}/stat').splitlines():
+        if line.startswith('btime '):
+            return float(line.split()[1])
+    raise ValueError('btime not found')
 
 #------------------------------------------------------------------------------
-def sumColumn(data, col=0):
-    # col argument is like index -- i.e. first column is 0
-    success, result = do_shell_script(k_awkSumColumn(data=cmd_quote(data), col=col+1))
-    if success:
-        return float(result)
-    else:
-        self.logger.error(result)
-        return 0.0
+def proc_mem_total(procPath):
+    for line in read_file(f'{procPath}/meminfo').splitlines():
+        if line.startswith('MemTotal:'):
+            return float(line.split()[1]) * 1024
+    raise ValueError('MemTotal not found')
 
 #------------------------------------------------------------------------------
+_cores = None
 def countCores():
-    success, result = do_shell_script(k_countCoresCmd)
-    if success:
-        return float(result)
-    else:
-        self.logger.error(result)
-        return 1.0
+    # logical cpu count, same as 'sysctl -n hw.ncpu', read once without forking
+    global _cores
+    if _cores is None:
+        _cores = float(os.cpu_count() or 1)
+    return _cores
@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Offline benchmarks for the Mac Apps plugin.
+
+Runs plugin.py against a stand-in indigo module (stub/indigo.py) and synthetic
+ps listings (synthetic.py), so it works on any machine with Python 3:
+
+    python benchmarks/bench.py                          # full grid, JSON on stdout
+    python benchmarks/bench.py --quick                  # small grid
+    python benchmarks/bench.py --output bench_output.txt --save-baseline baseline.json
+    python benchmarks/bench.py --baseline baseline.json # exits 1 on regressions
+
+Two kinds of results are reported:
+  micro:  nanoseconds per call for the per-row helpers and table lookups
+  loop:   runConcurrentThread driven one tick at a time with every device due,
+          for each combination of process and device counts.  Per tick: latency
+          percentiles, commands run, states pushed and traced allocations.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+k_benchDir      = os.path.dirname(os.path.abspath(__file__))
+k_pluginDir     = os.path.join(k_benchDir, '..', 'Mac Apps.indigoPlugin', 'Contents', 'Server Plugin')
+sys.path[0:0]   = [os.path.join(k_benchDir, 'stub'), k_pluginDir, k_benchDir]
+
+import indigo
+import plugin
+from synthetic import SyntheticHost, app_name, daemon_name
+
+k_processCounts = (100, 1000, 10000)
+k_deviceCounts  = (1, 10, 100, 1000)
+k_quickProcesses = (100, 1000)
+k_quickDevices  = (1, 10, 100)
+
+k_deviceTypes   = ('application','helper','daemon','sysload','procgroup','health')
+
+k_prefs         = { 'stateLoopFreq':    '10',
+                    'pushStatsFreq':    '0',    # stats on every tick, the worst case
+                    'pollMinFreq':      '2',
+                    'pollMaxFreq':      '60',
+                    'psBackend':        'ps',
+                    'watchExits':       False,  # synthetic pids can't be watched
+                    'divideByCores':    True,
+                    'showDebugInfo':    False }
+
+k_relayStates   = { 'onOffState':False, 'process_status':'off', 'process_id':'', 'last_start':'',
+                    'elapsed_secs':0, 'elapsed_time':'', 'percent_cpu':0.0, 'percent_mem':0.0 }
+
+###############################################################################
+class TickDriver(object):
+    """Replaces Plugin.sleep so each call ends one tick of runConcurrentThread:
+    records its latency, advances the synthetic host and makes every device due."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, instance, host, ticks, traceMemory=False):
+        self.plugin     = instance
+        self.host       = host
+        self.ticks      = ticks
+        self.traceMemory = traceMemory
+        self.latencies  = list()
+        self.commands   = list()
+        self.pushed     = list()
+        self.allocated  = list()
+        self.peaks      = list()
+
+    #------------------------------------------------------------------------------
+    def run(self):
+        self._begin()
+        try:
+            self.plugin.runConcurrentThread()
+        finally:
+            if self.traceMemory:
+                tracemalloc.stop()
+
+    #------------------------------------------------------------------------------
+    def sleep(self, seconds):
+        self.latencies.append(time.perf_counter() - self._start)
+        self.commands.append(self.host.commands - self._commands)
+        self.pushed.append(self.plugin.publisher.published - self._published)
+        if self.traceMemory:
+            current, peak = tracemalloc.get_traced_memory()
+            self.allocated.append(current - self._traced)
+            self.peaks.append(peak - self._traced)
+        if len(self.latencies) >= self.ticks:
+            raise self.plugin.StopThread()
+        self.host.tick()
+        self._begin()
+
+    #------------------------------------------------------------------------------
+    def _begin(self):
+        for entry in self.plugin.scheduler.entries.values():
+            entry['due'] = 0
+        self._commands  = self.host.commands
+        self._published = self.plugin.publisher.published
+        if self.traceMemory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._traced = tracemalloc.get_traced_memory()[0]
+        self._start = time.perf_counter()
+
+###############################################################################
+def make_plugin(host):
+    plugin.do_shell_script = host.do_shell_script
+    instance = plugin.Plugin('com.benchmark.macapps', 'Mac Apps', '0.0.0', indigo.Dict(k_prefs))
+    instance.startup()
+    return instance
+
+#------------------------------------------------------------------------------
+def make_device(devId, index, host):
+    deviceTypeId = k_deviceTypes[index % len(k_deviceTypes)]
+    # every other round of devices names apps that aren't running, so both the
+    # bound pid lookup and the unbound name search are exercised
+    round_ = index // len(k_deviceTypes)
+    app = round_ % host.apps + [0, host.apps][round_ % 2]
+    if deviceTypeId == 'application':
+        props   = { 'applicationName': app_name(app), 'processName': app_name(app), 'forceQuit': False,
+                    'applicationPath': f'/Applications/{app_name(app)}.app', 'treeAccounting': index % 4 == 0 }
+    elif deviceTypeId == 'helper':
+        props   = { 'applicationName': f'{app_name(app)} Helper', 'processName': f'{app_name(app)} Helper', 'forceQuit': True,
+                    'applicationPath': f'/Applications/{app_name(app)}.app/Contents/{app_name(app)} Helper' }
+    elif deviceTypeId == 'daemon':
+        props   = { 'applicationName': daemon_name(app), 'processName': daemon_name(app), 'forceQuit': False,
+                    'applicationPath': f'/usr/local/bin/{daemon_name(app)}', 'startArgs': f'--config /etc/{daemon_name(app)}.conf' }
+    elif deviceTypeId == 'sysload':
+        props   = { 'topCount': '5' }
+    elif deviceTypeId == 'procgroup':
+        props   = [ { 'pattern': f'App{app % 100:02d}*', 'patternType': 'glob' },
+                    { 'pattern': f'proc{app % 10}[0-9]+ ', 'patternType': 'regex' } ][index % 2]
+    else:
+        props   = dict()
+    states = dict(k_relayStates) if deviceTypeId in ('application','helper','daemon') else dict()
+    device = indigo.Device(devId, f'{deviceTypeId} {index}', deviceTypeId, props, states)
+    device.version = '0.0.0'
+    return device
+
+#------------------------------------------------------------------------------
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values)-1))] if values else 0.0
+
+#------------------------------------------------------------------------------
+def timed(stmt, number):
+    # best of three, in nanoseconds per call
+    return round(min(timeit.repeat(stmt, number=number, repeat=3)) / number * 1e9, 1)
+
+###############################################################################
+def bench_micro(processCount=1000):
+    host = SyntheticHost(processCount)
+    lines = host.listing().splitlines()[1:]
+    records = plugin.PsSampler().parse('\n'.join(lines))
+    psTable = plugin.ProcessTable(records)
+    row = records[len(records)//2]
+    etimes = [record['etime'] for record in records]
+    lstarts = [record['lstart'] for record in records]
+    results = {
+        'parse_ps_row':         timed(lambda: [plugin.parse_ps_row(line) for line in lines], 20) / len(lines),
+        'etime_to_seconds':     timed(lambda: [plugin.etime_to_seconds(value) for value in etimes], 20) / len(etimes),
+        'lstart_to_timestamp':  timed(lambda: [plugin.lstart_to_timestamp(value) for value in lstarts], 5) / len(lstarts),
+        'table_totals':         timed(lambda: plugin.ProcessTable(records), 20) / len(records),
+        'find_pid':             timed(lambda: psTable.findPid(row['pid']), 100000),
+        'find_app_name':        timed(lambda: psTable.findAppName(app_name(0)), 100000),
+        'find_app_cold':        timed(lambda: plugin.ProcessTable(records).findAppName('NoSuchApp'), 20),
+        }
+    return {key: round(value, 1) for key, value in results.items()}
+
+#------------------------------------------------------------------------------
+def bench_loop(processCount, deviceCount, ticks):
+    host = SyntheticHost(processCount)
+    instance = make_plugin(host)
+    for index in range(deviceCount):
+        instance.deviceStartComm(make_device(index+1, index, host))
+    plugin.k_snapshotMaxAge = 0    # sample on every tick
+
+    driver = TickDriver(instance, host, ticks)
+    instance.sleep = driver.sleep
+    driver.run()
+    # a second, shorter pass for allocations, since tracing slows everything down
+    tracer = TickDriver(instance, host, max(2, ticks//4), traceMemory=True)
+    instance.sleep = tracer.sleep
+    tracer.run()
+    instance.shutdown()
+
+    latencies = [value*1000 for value in driver.latencies[1:] or driver.latencies]
+    return {
+        'processes':        processCount,
+        'devices':          deviceCount,
+        'ticks':            len(driver.latencies),
+        'tick_p50_ms':      round(percentile(latencies, 0.50), 3),
+        'tick_p95_ms':      round(percentile(latencies, 0.95), 3),
+        'tick_max_ms':      round(max(latencies), 3),
+        'commands_per_tick': round(sum(driver.commands) / len(driver.commands), 2),
+        'states_per_tick':  round(sum(driver.pushed) / len(driver.pushed), 1),
+        'alloc_kb_per_tick': round(sum(tracer.allocated) / len(tracer.allocated) / 1024, 1),
+        'peak_kb_per_tick': round(max(tracer.peaks) / 1024, 1),
+        }
+
+###############################################################################
+def compare(results, baseline, tolerance):
+    # list of (name, baseline, current) for everything slower than baseline by more than tolerance
+    regressions = list()
+    for key, value in results['micro'].items():
+        previous = baseline.get('micro', {}).get(key)
+        if previous and value > previous * (1 + tolerance):
+            regressions.append((f'micro {key} ns', previous, value))
+    previousLoop = {(entry['processes'], entry['devices']): entry for entry in baseline.get('loop', [])}
+    for entry in results['loop']:
+        previous = previousLoop.get((entry['processes'], entry['devices']))
+        if not previous:
+            continue
+        name = f'loop {entry["processes"]} processes, {entry["devices"]} devices'
+        if entry['tick_p50_ms'] > previous['tick_p50_ms'] * (1 + tolerance):
+            regressions.append((f'{name} tick_p50_ms', previous['tick_p50_ms'], entry['tick_p50_ms']))
+        if entry['commands_per_tick'] > previous['commands_per_tick']:
+            regressions.append((f'{name} commands_per_tick', previous['commands_per_tick'], entry['commands_per_tick']))
+    return regressions
+
+#------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the Mac Apps plugin")
+    parser.add_argument('--quick', action='store_true', help="small grid, for a fast check")
+    parser.add_argument('--processes', type=int, nargs='+', help="process counts (default: %s)" % (k_processCounts,))
+    parser.add_argument('--devices', type=int, nargs='+', help="device counts (default: %s)" % (k_deviceCounts,))
+    parser.add_argument('--ticks', type=int, default=20, help="loop ticks per combination")
+    parser.add_argument('--output', help="write the JSON results here instead of stdout")
+    parser.add_argument('--save-baseline', help="also write the results here, for later --baseline runs")
+    parser.add_argument('--baseline', help="compare against results saved earlier")
+    parser.add_argument('--tolerance', type=float, default=0.20, help="allowed slowdown before a regression is reported")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    processCounts = args.processes or [k_processCounts, k_quickProcesses][args.quick]
+    deviceCounts = args.devices or [k_deviceCounts, k_quickDevices][args.quick]
+
+    results = { 'python':   platform.python_version(),
+                'platform': platform.platform(),
+                'time':     time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'micro':    bench_micro(),
+                'loop':     list() }
+    for processCount in processCounts:
+        for deviceCount in deviceCounts:
+            entry = bench_loop(processCount, deviceCount, args.ticks)
+            print(f'{processCount:>6} processes {deviceCount:>5} devices: p50 {entry["tick_p50_ms"]:.2f} ms, '
+                  f'p95 {entry["tick_p95_ms"]:.2f} ms, {entry["commands_per_tick"]} commands/tick', file=sys.stderr)
+            results['loop'].append(entry)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, previous, current in regressions:
+            print(f'REGRESSION {name}: {previous} -> {current}', file=sys.stderr)
+        if regressions:
+            return 1
+        print("no regressions against baseline", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Checks the process group matcher against matching each pattern on its own.
+
+GroupMatcher folds every group pattern into one combined regex.  This runs a
+set of glob and regex patterns, including ones that can't be folded, over
+synthetic process names and compares each answer with fnmatch / re.search:
+
+    python benchmarks/groups.py             # exits 1 on mismatches
+"""
+
+import argparse
+import fnmatch
+import logging
+import os
+import re
+import sys
+
+k_benchDir      = os.path.dirname(os.path.abspath(__file__))
+k_pluginDir     = os.path.join(k_benchDir, '..', 'Mac Apps.indigoPlugin', 'Contents', 'Server Plugin')
+sys.path[0:0]   = [os.path.join(k_benchDir, 'stub'), k_pluginDir, k_benchDir]
+
+import indigo
+import plugin
+from synthetic import SyntheticHost
+
+k_patterns      = ( ('App00*',                  'glob'),
+                    ('* Helper --type=*',       'glob'),
+                    ('daemon000[0-4]*',         'glob'),
+                    ('proc0*',                  'glob'),
+                    (r'Helper',                 'regex'),
+                    (r'^daemon\d+ --config',    'regex'),
+                    (r'(?i)app0001',            'regex'),   # inline flags
+                    (r'(r)(o)\2',               'regex'),   # numbered backreference
+                    (r'(p)\1',                  'regex'),
+                    (r'(?P<d>\d)(?P=d)',        'regex'),   # named backreference
+                    (r'(App)?(?(1)00|proc)1',   'regex'),   # conditional on a group number
+                    (r'flag[13]$',              'regex'),
+                    ('[invalid',                'regex') )
+
+#------------------------------------------------------------------------------
+def expected(pattern, patternType, args):
+    if patternType == 'glob':
+        return fnmatch.fnmatchcase(args, pattern)
+    try:
+        return re.search(pattern, args) is not None
+    except re.error:
+        return False
+
+#------------------------------------------------------------------------------
+def check(names, patterns):
+    matcher = plugin.GroupMatcher()
+    for devId, (pattern, patternType) in enumerate(patterns, 1):
+        matcher.add(devId, pattern, patternType)
+    mismatches = list()
+    for args in names:
+        found = set(matcher.groupsFor(args))
+        for devId, (pattern, patternType) in enumerate(patterns, 1):
+            if (devId in found) != expected(pattern, patternType, args):
+                mismatches.append((args, pattern, devId in found))
+    return mismatches
+
+#------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the group matcher with matching each pattern alone")
+    parser.add_argument('--processes', type=int, default=2000, help="synthetic process names to check")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    host = SyntheticHost(args.processes)
+    names = sorted({process['args'] for process in host.processes.values()} | {'error', 'proc', 'apple 11'})
+    # every pattern on its own, then all of them folded together
+    mismatches = list()
+    for pattern in k_patterns:
+        mismatches += check(names, [pattern])
+    mismatches += check(names, k_patterns)
+    for name, pattern, found in mismatches:
+        print(f'MISMATCH {name!r} {pattern!r}: matcher {found}, expected {not found}', file=sys.stderr)
+    print(f"{len(names)} names x {len(k_patterns)} patterns checked alone and combined, {len(mismatches)} mismatches", file=sys.stderr)
+    return [0,1][bool(mismatches)]
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Checks that the ps and /proc sampling backends agree on the live host.
+
+Both backends are sampled back to back and every pid they both report is
+compared on the fields the plugin matches and links devices on:
+
+    python benchmarks/parity.py             # exits 1 on mismatches
+
+Needs /proc and a ps that accepts the plugin's options, i.e. Linux.  CPU,
+memory and state are left out, as they change between the two samples.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+k_benchDir      = os.path.dirname(os.path.abspath(__file__))
+k_pluginDir     = os.path.join(k_benchDir, '..', 'Mac Apps.indigoPlugin', 'Contents', 'Server Plugin')
+sys.path[0:0]   = [os.path.join(k_benchDir, 'stub'), k_pluginDir]
+
+import indigo
+import plugin
+
+k_startSlack    = 1.0   # seconds; the backends round start times independently
+k_reuseSlack    = 60.0
+
+#------------------------------------------------------------------------------
+def sample_both():
+    success, psRecords = plugin.PsSampler().sample()
+    if not success:
+        raise RuntimeError("ps sample failed")
+    success, procRecords = plugin.ProcSampler().sample()
+    if not success:
+        raise RuntimeError("/proc sample failed")
+    return ({int(row['pid']):row for row in psRecords if row['pid']},
+            {int(row['pid']):row for row in procRecords})
+
+#------------------------------------------------------------------------------
+def compare(psRows, procRows):
+    mismatches = list()
+    common = set(psRows) & set(procRows)
+    for pid in sorted(common):
+        ps, proc = psRows[pid], procRows[pid]
+        psStart, procStart = plugin.lstart_to_timestamp(ps['lstart']), plugin.lstart_to_timestamp(proc['lstart'])
+        if psStart is None or procStart is None:
+            mismatches.append((pid, 'lstart', ps['lstart'], proc['lstart']))
+        elif abs(psStart - procStart) > k_reuseSlack:
+            continue    # pid reused between the two samples, a different process
+        elif abs(psStart - procStart) > k_startSlack:
+            mismatches.append((pid, 'lstart', ps['lstart'], proc['lstart']))
+        for key in ('ppid', 'args'):
+            if str(ps[key]) != str(proc[key]):
+                mismatches.append((pid, key, ps[key], proc[key]))
+    return common, mismatches
+
+#------------------------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the ps and /proc sampling backends")
+    parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if not os.path.isdir(plugin.k_procPath):
+        print(f"{plugin.k_procPath} is not available, nothing to compare", file=sys.stderr)
+        return 0
+
+    common, mismatches = compare(*sample_both())
+    for pid, key, psValue, procValue in mismatches:
+        print(f'MISMATCH pid {pid} {key}: ps {psValue!r} /proc {procValue!r}', file=sys.stderr)
+    print(f"{len(common)} processes compared, {len(mismatches)} mismatches", file=sys.stderr)
+    return [0,1][bool(mismatches) or not common]
+
+if __name__ == '__main__':
+    sys.exit(main())
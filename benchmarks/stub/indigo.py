@@ -0,0 +1,96 @@
+"""Stand-in for the indigo module that Indigo Server injects into plugins, with
+just enough of the API for plugin.py to run outside the server."""
+
+import logging
+
+###############################################################################
+class _Constants(object):
+    # any attribute is a constant named after itself
+    def __getattr__(self, name):
+        return name
+
+kStateImageSel      = _Constants()
+kDimmerRelayAction  = _Constants()
+kUniversalAction    = _Constants()
+kDeviceAction       = _Constants()
+
+###############################################################################
+class Dict(dict):
+    def iteritems(self):
+        return iter(list(self.items()))
+
+class List(list):
+    pass
+
+###############################################################################
+class Device(object):
+    """Keeps its states in a dict and records every updateStatesOnServer call."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, devId, name, deviceTypeId, props, states):
+        self.id             = devId
+        self.name           = name
+        self.deviceTypeId   = deviceTypeId
+        self.pluginProps    = Dict(props)
+        self.configured     = True
+        self.version        = None
+        self.onState        = states.get('onOffState')
+        self.updates        = list()
+        self._states        = Dict(states)
+
+    #------------------------------------------------------------------------------
+    @property
+    def states(self):
+        # the server hands out a copy
+        return Dict(self._states)
+
+    #------------------------------------------------------------------------------
+    def updateStatesOnServer(self, newStates):
+        self.updates.append(newStates)
+        for item in newStates:
+            self._states[item['key']] = item['value']
+        self.onState = self._states.get('onOffState')
+
+    def updateStateOnServer(self, key, value, **kwargs):
+        self.updateStatesOnServer([dict(kwargs, key=key, value=value)])
+
+    def updateStateImageOnServer(self, image):
+        pass
+
+    def stateListOrDisplayStateIdChanged(self):
+        pass
+
+    def replacePluginPropsOnServer(self, props):
+        self.pluginProps = Dict(props)
+
+###############################################################################
+class PluginBase(object):
+
+    class StopThread(Exception):
+        pass
+
+    #------------------------------------------------------------------------------
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId       = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion  = pluginVersion
+        self.pluginPrefs    = pluginPrefs
+        self.logger         = logging.getLogger(pluginDisplayName)
+
+    def __del__(self):
+        pass
+
+    #------------------------------------------------------------------------------
+    def sleep(self, seconds):
+        # replaced by the harness to drive runConcurrentThread one tick at a time
+        raise self.StopThread()
+
+    #------------------------------------------------------------------------------
+    def getDeviceStateList(self, dev):
+        return List()
+
+    def getDeviceStateDictForStringType(self, key, triggerLabel, controlPageLabel):
+        return {'Key': key, 'Type': 'string', 'TriggerLabel': triggerLabel, 'StateLabel': controlPageLabel}
+
+    def getDeviceStateDictForNumberType(self, key, triggerLabel, controlPageLabel):
+        return {'Key': key, 'Type': 'number', 'TriggerLabel': triggerLabel, 'StateLabel': controlPageLabel}
@@ -0,0 +1,115 @@
+"""Synthetic process lists in the format of the plugin's ps commands, plus a
+do_shell_script replacement that serves them, so the plugin can be exercised
+without macOS or real processes."""
+
+import random
+import time
+
+k_psHeader      = "  PID  PPID STAT  %CPU %MEM STARTED                      ELAPSED ARGS"
+k_psRow         = "{pid:>5} {ppid:>5} {state:<5}{pcpu:>5.1f} {pmem:>4.1f} {lstart}   {etime:>11} {args}".format
+k_psStates      = ('S','Ss','R','S+','I','U','T')
+
+k_appCount      = 0.05  # fraction of processes that are apps, each with a helper and a daemon
+
+###############################################################################
+class SyntheticHost(object):
+    """A process table that changes a little on every tick: cpu and memory
+    values drift and a fraction of the processes exit and are replaced."""
+
+    #------------------------------------------------------------------------------
+    def __init__(self, processCount, churn=0.01, seed=0):
+        self.random     = random.Random(seed)
+        self.churn      = churn
+        self.now        = time.time()
+        self.processes  = dict()
+        self.commands   = 0
+        self._nextPid   = 100
+        self.apps       = max(1, int(processCount * k_appCount))
+
+        # generic processes are children of launchd or of an app
+        self._parents   = [self._add(1, 0, 'launchd', 30*86400)]
+        for index in range(self.apps):
+            pid = self._add(None, 1, app_name(index), self.random.uniform(60, 86400))
+            self._add(None, pid, f'{app_name(index)} Helper --type=renderer', self.random.uniform(1, 3600))
+            self._add(None, 1, f'{daemon_name(index)} --config /etc/{daemon_name(index)}.conf', self.random.uniform(60, 86400))
+            self._parents.append(pid)
+        while len(self.processes) < processCount:
+            self._add(None, self.random.choice(self._parents), self._genericName(), self.random.uniform(1, 86400))
+        self._render()
+
+    #------------------------------------------------------------------------------
+    def tick(self, seconds=1.0):
+        self.now += seconds
+        for process in self.processes.values():
+            process['pcpu'] = max(0.0, process['pcpu'] + self.random.uniform(-2.0, 2.0))
+            process['pmem'] = max(0.0, process['pmem'] + self.random.uniform(-0.05, 0.05))
+        # generic processes come and go; apps, helpers and daemons stay put
+        generic = [pid for pid, process in self.processes.items() if process['generic']]
+        for pid in self.random.sample(generic, min(len(generic), int(len(self.processes) * self.churn))):
+            del self.processes[pid]
+            self._add(None, self.random.choice(self._parents), self._genericName(), 0)
+        self._render()
+
+    #------------------------------------------------------------------------------
+    def listing(self, pids=None):
+        if pids is None:
+            return self._listing
+        return '\n'.join([k_psHeader] + [self._rows[pid] for pid in sorted(pids) if pid in self._rows])
+
+    #------------------------------------------------------------------------------
+    def do_shell_script(self, cmd, timeout=None):
+        # stands in for plugin.do_shell_script; ps commands are answered from the table
+        self.commands += 1
+        if cmd.startswith('/bin/ps'):
+            pids = None
+            for option in cmd.split():
+                if option.startswith('-p'):
+                    pids = {int(pid) for pid in option[2:].split(',')}
+            return True, self.listing(pids).encode('utf-8')
+        return True, b''
+
+    #------------------------------------------------------------------------------
+    def _add(self, pid, ppid, args, age):
+        if pid is None:
+            pid = self._nextPid
+            self._nextPid += 1
+        self.processes[pid] = { 'ppid':     ppid,
+                                'state':    self.random.choice(k_psStates),
+                                'pcpu':     self.random.expovariate(0.5),
+                                'pmem':     self.random.expovariate(5.0),
+                                'start':    int(self.now - age),
+                                'args':     args,
+                                'generic':  args.startswith('proc') }
+        return pid
+
+    #------------------------------------------------------------------------------
+    def _render(self):
+        # rendered once per tick, so formatting isn't counted as plugin time
+        self._rows = dict()
+        for pid, process in self.processes.items():
+            self._rows[pid] = k_psRow(pid=pid, ppid=process['ppid'], state=process['state'], pcpu=process['pcpu'], pmem=process['pmem'],
+                                      lstart=time.strftime('%a %b %e %H:%M:%S %Y', time.localtime(process['start'])),
+                                      etime=etime(int(self.now - process['start'])), args=process['args'])
+        self._listing = '\n'.join([k_psHeader] + list(self._rows.values()))
+
+    #------------------------------------------------------------------------------
+    def _genericName(self):
+        return f'proc{self.random.randrange(100000):05d} -flag{self.random.randrange(10)}'
+
+###############################################################################
+def app_name(index):
+    return f'App{index:04d}'
+
+def daemon_name(index):
+    return f'daemon{index:04d}'
+
+#------------------------------------------------------------------------------
+def etime(seconds):
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f'{days}-{hours:02d}:{minutes:02d}:{seconds:02d}'
+    if hours:
+        return f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+    return f'{minutes:02d}:{seconds:02d}'